@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from operators import TICKET_PAGO, TICKET_PREGUNTA
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Inline button actions (one character each, to keep callback_data short)
+CONFIRMAR = 'c'
+RECHAZAR = 'x'
+RESPONDER = 'r'
+SPAM = 's'
+
+ACCIONES = frozenset((CONFIRMAR, RECHAZAR, RESPONDER, SPAM))
+CODIGOS_TIPO = {TICKET_PAGO: 'p', TICKET_PREGUNTA: 'q'}
+TIPOS_POR_CODIGO = {codigo: tipo for tipo, codigo in CODIGOS_TIPO.items()}
+BYTES_FIRMA = 8
+
+class RegistroAcciones:
+    """
+    Signed callback tokens for the operator buttons, and the outcome of every ticket resolved through them.
+
+    A token is '<action><ticket kind><ticket id>.<chat id>.<truncated HMAC>' (ids in hex, about
+    30 bytes, under Telegram's 64), so a forged or tampered callback is rejected before touching
+    any state. Ticket ids restart on every boot, so the key includes a per-boot nonce: buttons
+    sent before a restart stop validating instead of pointing at a new ticket with the same id.
+    Outcomes are kept in a bounded LRU so a second tap on a resolved ticket, from any of its
+    notifications, just reports what already happened.
+    """
+
+    def __init__(self, token_bot, capacidad=5000):
+        self._clave = hashlib.sha256(b'acciones:' + os.urandom(16) + token_bot.encode()).digest()
+        self.capacidad = capacidad
+        self._resultados = OrderedDict()  # ticket_id -> outcome shown to operators
+        self._en_curso = set()
+
+    def _firma(self, carga):
+        digest = hmac.new(self._clave, carga.encode(), hashlib.sha256).digest()[:BYTES_FIRMA]
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def token(self, accion, ticket):
+        """callback_data for an action on a ticket."""
+        carga = f"{accion}{CODIGOS_TIPO[ticket['tipo']]}{ticket['id']:x}.{ticket['chat_id']:x}"
+        return f"{carga}.{self._firma(carga)}"
+
+    def resolver(self, datos):
+        """Return (action, ticket_id, chat_id, ticket kind) for a genuine token, or None."""
+        carga, _, firma = (datos or '').rpartition('.')
+        cabecera, _, chat = carga.partition('.')
+        if len(cabecera) < 3 or cabecera[0] not in ACCIONES or cabecera[1] not in TIPOS_POR_CODIGO:
+            return None
+        if not hmac.compare_digest(firma.encode(), self._firma(carga).encode()):
+            return None
+        try:
+            return cabecera[0], int(cabecera[2:], 16), int(chat, 16), TIPOS_POR_CODIGO[cabecera[1]]
+        except ValueError:
+            return None
+
+    def resultado(self, ticket_id):
+        """Outcome of a ticket already resolved through a button, or None."""
+        return self._resultados.get(ticket_id)
+
+    def iniciar(self, ticket_id):
+        """Start acting on a ticket. False if it is already being handled or was resolved."""
+        if ticket_id in self._en_curso or ticket_id in self._resultados:
+            return False
+        self._en_curso.add(ticket_id)
+        return True
+
+    def terminar(self, ticket_id, resultado=None):
+        """Finish acting on a ticket; with a resultado the ticket counts as resolved."""
+        self._en_curso.discard(ticket_id)
+        if resultado is None:
+            return
+        self._resultados[ticket_id] = resultado
+        self._resultados.move_to_end(ticket_id)
+        if len(self._resultados) > self.capacidad:
+            self._resultados.popitem(last=False)
+
+registro = Proxy('acciones')  # Button tokens and outcomes of the current tenant
+
+def teclado(ticket):
+    """Inline buttons for an operator notification about a ticket."""
+    if ticket['tipo'] == TICKET_PAGO:
+        filas = [
+            [
+                InlineKeyboardButton("✅ Confirmar", callback_data=registro.token(CONFIRMAR, ticket)),
+                InlineKeyboardButton("❌ Rechazar", callback_data=registro.token(RECHAZAR, ticket))
+            ],
+            [InlineKeyboardButton("🚫 Spam", callback_data=registro.token(SPAM, ticket))]
+        ]
+    elif ticket['tipo'] == TICKET_PREGUNTA:
+        filas = [[
+            InlineKeyboardButton("✍️ Responder", callback_data=registro.token(RESPONDER, ticket)),
+            InlineKeyboardButton("🚫 Spam", callback_data=registro.token(SPAM, ticket))
+        ]]
+    else:
+        return None
+    return InlineKeyboardMarkup(filas)
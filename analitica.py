@@ -0,0 +1,135 @@
+import datetime
+import logging
+import os
+import time
+
+import numpy as np
+
+import eventos
+
+logger = logging.getLogger(__name__)
+
+# Same layout as eventos.REGISTRO, so segments map straight into columns
+DTYPE_EVENTO = np.dtype([
+    ('ts', '<f8'),
+    ('tipo', 'u1'),
+    ('servicio', 'u1'),
+    ('tipo_sesion', 'u1'),
+    ('_relleno', 'V5'),
+    ('chat_id', '<i8'),
+    ('monto_usd', '<f8'),
+    ('tasa', '<f8'),
+    ('valor', '<f8')
+])
+assert DTYPE_EVENTO.itemsize == eventos.REGISTRO.size
+
+ETAPAS_EMBUDO = [
+    (eventos.SERVICIO_ELEGIDO, 'Eligieron servicio'),
+    (eventos.PAGO_SOLICITADO, 'Pidieron datos de pago'),
+    (eventos.COMPROBANTE_RECIBIDO, 'Enviaron comprobante'),
+    (eventos.PAGO_CONFIRMADO, 'Pago confirmado'),
+    (eventos.PREGUNTA, 'Hicieron preguntas')
+]
+
+def cargar_columnas(segmentos, desde=None, columnas=('ts', 'tipo', 'chat_id', 'monto_usd', 'tasa', 'valor')):
+    """
+    Memory-map the segments and return the requested columns as contiguous arrays.
+    With desde (a timestamp), only events from then on are loaded: records are appended in
+    time order, so older segments are skipped by their last record and the first one is sliced.
+    """
+    mapas = []
+    for ruta in segmentos:
+        registros = os.path.getsize(ruta) // DTYPE_EVENTO.itemsize
+        if not registros:
+            continue
+        mapa = np.memmap(ruta, dtype=DTYPE_EVENTO, mode='r', shape=(registros,))
+        if desde is not None and not mapas:
+            if mapa['ts'][-1] < desde:
+                continue
+            mapa = mapa[int(np.searchsorted(mapa['ts'], desde)):]
+        mapas.append(mapa)
+    if not mapas:
+        return {columna: np.empty(0, dtype=DTYPE_EVENTO[columna]) for columna in columnas}
+    return {columna: np.concatenate([m[columna] for m in mapas]) for columna in columnas}
+
+def ingresos_diarios(datos, dias=7, ahora=None):
+    """Return [(date, usd, bs, payments)] for the last N local days, oldest first."""
+    ahora = ahora or time.time()
+    desfase = time.localtime(ahora).tm_gmtoff
+    dia_actual = int((ahora + desfase) // 86400)
+
+    mascara = datos['tipo'] == eventos.PAGO_CONFIRMADO
+    dia = ((datos['ts'][mascara] + desfase) // 86400).astype(np.int64) - (dia_actual - dias + 1)
+    en_rango = (dia >= 0) & (dia < dias)
+    dia = dia[en_rango]
+    usd = datos['monto_usd'][mascara][en_rango]
+    bs = usd * datos['tasa'][mascara][en_rango]
+
+    total_usd = np.bincount(dia, weights=usd, minlength=dias)
+    total_bs = np.bincount(dia, weights=bs, minlength=dias)
+    pagos = np.bincount(dia, minlength=dias)
+
+    primer_dia = datetime.date.fromtimestamp(ahora) - datetime.timedelta(days=dias - 1)
+    return [
+        (primer_dia + datetime.timedelta(days=i), float(total_usd[i]), float(total_bs[i]), int(pagos[i]))
+        for i in range(dias)
+    ]
+
+def embudo(datos, desde=None):
+    """Return [(stage name, unique chats)] for the conversion funnel."""
+    tipos = datos['tipo']
+    chats = datos['chat_id']
+    if desde is not None:
+        recientes = datos['ts'] >= desde
+        tipos = tipos[recientes]
+        chats = chats[recientes]
+    return [(nombre, int(np.unique(chats[tipos == tipo]).size)) for tipo, nombre in ETAPAS_EMBUDO]
+
+def percentiles_respuesta(datos, desde=None, percentiles=(50, 90, 99)):
+    """Return (count, {percentile: seconds}) of operator answer times."""
+    mascara = datos['tipo'] == eventos.RESPUESTA
+    if desde is not None:
+        mascara &= datos['ts'] >= desde
+    tiempos = datos['valor'][mascara]
+    if not tiempos.size:
+        return 0, {}
+    valores = np.percentile(tiempos, percentiles)
+    return int(tiempos.size), dict(zip(percentiles, (float(v) for v in valores)))
+
+def _duracion(segundos):
+    """Format seconds as a short human duration."""
+    if segundos < 60:
+        return f"{segundos:.0f}s"
+    if segundos < 3600:
+        return f"{segundos / 60:.1f} min"
+    return f"{segundos / 3600:.1f} h"
+
+def generar_reporte(dias=7):
+    """Build the /stats text report over the last N days of events."""
+    inicio = time.perf_counter()
+    desde = time.time() - dias * 86400
+    datos = cargar_columnas(eventos.registro.segmentos(), desde)
+
+    lineas = [f"📈 **Estadísticas (últimos {dias} días)**\n", "💰 **Ingresos diarios:**"]
+    total_usd = total_bs = 0.0
+    for fecha, usd, bs, pagos in ingresos_diarios(datos, dias):
+        total_usd += usd
+        total_bs += bs
+        lineas.append(f"• {fecha.strftime('%d/%m')}: {usd:.2f}$ · {bs:.2f} Bs ({pagos} pagos)")
+    lineas.append(f"**Total:** {total_usd:.2f}$ · {total_bs:.2f} Bs\n")
+
+    lineas.append("🔻 **Embudo de conversión:**")
+    etapas = embudo(datos, desde)
+    base = etapas[0][1] or 1
+    for nombre, usuarios in etapas:
+        lineas.append(f"• {nombre}: {usuarios} ({usuarios * 100 / base:.0f}%)")
+
+    respuestas, valores = percentiles_respuesta(datos, desde)
+    lineas.append(f"\n⏱️ **Tiempo de respuesta** ({respuestas} respuestas):")
+    if valores:
+        lineas.append(" · ".join(f"p{p}: {_duracion(v)}" for p, v in valores.items()))
+    else:
+        lineas.append("Sin respuestas registradas.")
+
+    lineas.append(f"\n_{datos['tipo'].size} eventos analizados en {(time.perf_counter() - inicio) * 1000:.0f} ms_")
+    return "\n".join(lineas)
@@ -0,0 +1,177 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Record header: kind, payload length, crc32 of payload, sequence number
+CABECERA = struct.Struct('<BIIQ')
+TIPO_UPDATE = 1
+TIPO_COMPLETADO = 2
+
+# Backoff between attempts to rewrite the journal after a write error
+REINTENTO_MIN_SEGUNDOS = 0.5
+REINTENTO_MAX_SEGUNDOS = 30.0
+
+class BitacoraIngreso:
+    """
+    Write-ahead journal of raw inbound updates.
+
+    anotar() returns only once the update is fsync'ed, so it is safe to acknowledge
+    the webhook afterwards. A single writer thread commits whatever accumulated while
+    the previous fsync was running (group commit): under load many updates share one
+    fsync, and an idle journal pays a single fsync per update.
+    completar() appends a "done" marker that rides along with the next batch.
+    On boot, abrir() returns the updates that never got their marker.
+
+    A write error fails the updates of that batch and every anotar() until the writer
+    manages to rewrite the journal from memory (retried with backoff); sana() reports it.
+    """
+
+    def __init__(self, ruta, max_bytes=64 * 1024 * 1024):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._condicion = threading.Condition()
+        self._buffer = bytearray()
+        self._secuencia = 0
+        self._ultimo_encolado = 0
+        self._ultimo_durable = 0
+        self._en_vuelo = {}  # seq -> raw update, kept for compaction
+        self._error = None
+        self._fallido = 0  # Updates up to this sequence number were lost to a write error
+        self._archivo = None
+        self._hilo = None
+
+    def abrir(self):
+        """Read the existing journal, compact it and start the writer thread. Returns pending updates."""
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        pendientes = self._leer()
+        self._en_vuelo = dict(pendientes)
+        self._secuencia = max(self._en_vuelo, default=self._secuencia)
+        self._ultimo_encolado = self._ultimo_durable = self._secuencia
+        self._compactar()
+        self._hilo = threading.Thread(target=self._escribir, name="bitacora-ingreso", daemon=True)
+        self._hilo.start()
+        if pendientes:
+            logger.warning("Journal has %s unfinished updates to replay.", len(pendientes))
+        return pendientes
+
+    def _leer(self):
+        """Return [(seq, raw)] of updates without a completion marker, in arrival order."""
+        if not os.path.exists(self.ruta):
+            return []
+        pendientes = {}
+        with open(self.ruta, 'rb') as f:
+            datos = f.read()
+        posicion = 0
+        while posicion + CABECERA.size <= len(datos):
+            tipo, longitud, crc, secuencia = CABECERA.unpack_from(datos, posicion)
+            inicio = posicion + CABECERA.size
+            carga = datos[inicio:inicio + longitud]
+            if len(carga) < longitud or zlib.crc32(carga) != crc:
+                logger.warning("Journal truncated at byte %s; ignoring torn tail.", posicion)
+                break
+            if tipo == TIPO_UPDATE:
+                pendientes[secuencia] = bytes(carga)
+            elif tipo == TIPO_COMPLETADO:
+                pendientes.pop(secuencia, None)
+            self._secuencia = max(self._secuencia, secuencia)
+            posicion = inicio + longitud
+        return sorted(pendientes.items())
+
+    def _compactar(self):
+        """Rewrite the journal with only in-flight updates (atomic replace)."""
+        if self._archivo:
+            self._archivo.close()
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'wb') as f:
+            for secuencia, raw in sorted(self._en_vuelo.items()):
+                f.write(CABECERA.pack(TIPO_UPDATE, len(raw), zlib.crc32(raw), secuencia) + raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+        self._archivo = open(self.ruta, 'ab')
+
+    def anotar(self, raw):
+        """Durably journal a raw update and return its sequence number."""
+        with self._condicion:
+            if self._error:
+                raise self._error
+            self._secuencia += 1
+            secuencia = self._secuencia
+            self._buffer += CABECERA.pack(TIPO_UPDATE, len(raw), zlib.crc32(raw), secuencia)
+            self._buffer += raw
+            self._en_vuelo[secuencia] = raw
+            self._ultimo_encolado = secuencia
+            self._condicion.notify_all()
+            while self._ultimo_durable < secuencia:
+                if secuencia <= self._fallido:
+                    raise self._error or OSError("Ingest journal write failed")
+                self._condicion.wait()
+        return secuencia
+
+    def sana(self):
+        """False while the journal cannot be written and updates are being refused."""
+        return self._error is None
+
+    def completar(self, secuencia):
+        """Mark an update as fully handled; it will not be replayed."""
+        with self._condicion:
+            self._en_vuelo.pop(secuencia, None)
+            self._buffer += CABECERA.pack(TIPO_COMPLETADO, 0, zlib.crc32(b''), secuencia)
+            self._condicion.notify_all()
+
+    def _escribir(self):
+        """Writer thread: flush and fsync accumulated records in batches."""
+        while True:
+            with self._condicion:
+                while not self._buffer:
+                    self._condicion.wait()
+                lote = self._buffer
+                self._buffer = bytearray()
+                hasta = self._ultimo_encolado
+            try:
+                self._archivo.write(lote)
+                self._archivo.flush()
+                os.fsync(self._archivo.fileno())
+                if self._archivo.tell() > self.max_bytes:
+                    with self._condicion:
+                        self._compactar()
+            except Exception as e:
+                logger.error("Error writing ingest journal: %s", e)
+                self._recuperar(e)
+                continue
+            with self._condicion:
+                self._ultimo_durable = max(self._ultimo_durable, hasta)
+                self._condicion.notify_all()
+
+    def _recuperar(self, error):
+        """Fail the batch that could not be written, then rewrite the journal until it works."""
+        with self._condicion:
+            # Their senders get an error (the webhook answers 500 and Telegram retries them)
+            for secuencia in range(self._ultimo_durable + 1, self._secuencia + 1):
+                self._en_vuelo.pop(secuencia, None)
+            self._fallido = self._secuencia
+            self._buffer = bytearray()  # Pending markers are already reflected in _en_vuelo
+            self._error = error
+            self._condicion.notify_all()
+        espera = REINTENTO_MIN_SEGUNDOS
+        while True:
+            time.sleep(espera)
+            with self._condicion:
+                try:
+                    self._compactar()
+                except Exception as e:
+                    logger.error("Ingest journal still failing, retrying in %.1f s: %s", espera, e)
+                else:
+                    self._ultimo_durable = self._secuencia
+                    self._error = None
+                    self._condicion.notify_all()
+                    logger.warning("Ingest journal recovered after a write error.")
+                    return
+            espera = min(espera * 2, REINTENTO_MAX_SEGUNDOS)
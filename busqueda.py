@@ -0,0 +1,303 @@
+import asyncio
+import atexit
+import logging
+import math
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+
+import numpy as np
+
+from config import BUSQUEDA_INSTANTANEA_DOCUMENTOS, BUSQUEDA_INSTANTANEA_SEGUNDOS
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Document kinds
+PREGUNTA = 1
+RESPUESTA = 2
+
+# Documents log record: chat_id, timestamp, kind, text length (UTF-8 text follows)
+CABECERA_DOCUMENTO = struct.Struct('<qdBI')
+VERSION_INSTANTANEA = 1
+RESULTADOS_POR_PAGINA = 10
+REVISION_INSTANTANEA_SEGUNDOS = 5.0
+
+PATRON_TOKEN = re.compile(r'[a-z0-9]+')
+PALABRAS_VACIAS = frozenset(
+    "a al algo como con de del el ella en es esa ese eso esta este esto ha hay la las le les lo los "
+    "me mi mis muy no o para pero por que se si sin su sus te tu tus un una uno unos y ya yo".split()
+)
+
+def normalizar(texto):
+    """Lowercase and strip accents (NFKD), so 'Educación' and 'educacion' are the same word."""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+def tokenizar(texto):
+    """Searchable tokens of a text, without Spanish stop words."""
+    return [t for t in PATRON_TOKEN.findall(normalizar(texto)) if len(t) > 1 and t not in PALABRAS_VACIAS]
+
+def _codificar(destino, numero):
+    """Append an unsigned varint."""
+    while numero >= 0x80:
+        destino.append((numero & 0x7F) | 0x80)
+        numero >>= 7
+    destino.append(numero)
+
+def decodificar_postings(datos):
+    """Decode delta-varint postings into (doc_ids, term frequencies) arrays, vectorized."""
+    crudos = np.frombuffer(datos, dtype=np.uint8)
+    fines = np.flatnonzero(crudos < 0x80)
+    inicios = np.concatenate(([0], fines[:-1] + 1))
+    grupo = np.repeat(np.arange(fines.size), fines - inicios + 1)
+    desplazamiento = (np.arange(crudos.size) - inicios[grupo]) * 7
+    valores = np.bincount(grupo, weights=(crudos & 0x7F).astype(np.float64) * np.exp2(desplazamiento), minlength=fines.size)
+    valores = valores.astype(np.int64)
+    return np.cumsum(valores[0::2]), valores[1::2].astype(np.float64)
+
+class IndiceBusqueda:
+    """
+    Incremental inverted index over questions and answers, ranked with BM25.
+
+    Each term keeps a bytearray of (doc_id gap, term frequency) varints, so appending
+    a message only touches the postings of its own words. Per-document metadata lives
+    in compact arrays and the texts stay on disk in the documents log, which is the
+    source of truth: a snapshot of the index is rewritten periodically and at exit, and
+    only the log tail after it has to be re-indexed.
+    """
+
+    def __init__(self, directorio, k1=1.2, b=0.75):
+        self.directorio = directorio
+        self.ruta_documentos = os.path.join(directorio, 'documentos.log')
+        self.ruta_instantanea = os.path.join(directorio, 'indice.snapshot')
+        self.k1 = k1
+        self.b = b
+        self._archivo = None
+        self._lock = threading.Lock()
+        self._vaciar()
+        self._documentos_instantanea = 0  # Documents covered by the last snapshot
+        self._desde_instantanea = None  # When the first document after it arrived (monotonic)
+
+    def _vaciar(self):
+        """Reset the in-memory index."""
+        self._terminos = {}  # term -> [postings bytearray, last doc_id, document frequency]
+        self._chats = array('q')
+        self._fechas = array('d')
+        self._tipos = array('B')
+        self._posiciones = array('Q')
+        # Grown by doubling: searches read a view of the first len(self) entries instead of copying
+        self._longitudes = np.zeros(1024, dtype=np.uint32)
+        self._total_longitud = 0
+
+    def __len__(self):
+        return len(self._chats)
+
+    def abrir(self):
+        """Load the snapshot, re-index the documents logged after it and open the log for appending."""
+        os.makedirs(self.directorio, exist_ok=True)
+        inicio = time.perf_counter()
+        fin_instantanea = self._cargar_instantanea()
+        tamano_log = os.path.getsize(self.ruta_documentos) if os.path.exists(self.ruta_documentos) else 0
+        if fin_instantanea > tamano_log:
+            logger.warning("Search snapshot is ahead of the documents log; rebuilding the index.")
+            self._vaciar()
+            fin_instantanea = 0
+        reindexados = 0
+        if tamano_log:
+            with open(self.ruta_documentos, 'rb') as f:
+                f.seek(fin_instantanea)
+                datos = f.read()
+            posicion = 0
+            while posicion + CABECERA_DOCUMENTO.size <= len(datos):
+                chat_id, fecha, tipo, longitud = CABECERA_DOCUMENTO.unpack_from(datos, posicion)
+                inicio_texto = posicion + CABECERA_DOCUMENTO.size
+                if inicio_texto + longitud > len(datos):
+                    break
+                texto = datos[inicio_texto:inicio_texto + longitud].decode('utf-8', 'replace')
+                self._agregar(chat_id, fecha, tipo, texto, fin_instantanea + posicion)
+                posicion = inicio_texto + longitud
+                reindexados += 1
+            fin_valido = fin_instantanea + posicion
+            if fin_valido < fin_instantanea + len(datos):
+                logger.warning("Search log truncated at byte %s; ignoring torn tail.", fin_valido)
+                with open(self.ruta_documentos, 'r+b') as f:
+                    f.truncate(fin_valido)
+        self._archivo = open(self.ruta_documentos, 'ab')
+        if reindexados:
+            self.guardar()
+        atexit.register(self.guardar)
+        logger.info(
+            "Search index ready: %s documents, %s terms (%s re-indexed) in %.0f ms.",
+            len(self), len(self._terminos), reindexados, (time.perf_counter() - inicio) * 1000
+        )
+
+    def _cargar_instantanea(self):
+        """Restore the index from its snapshot. Returns the log offset it covers (0 if none)."""
+        if not os.path.exists(self.ruta_instantanea):
+            return 0
+        try:
+            with open(self.ruta_instantanea, 'rb') as f:
+                datos = pickle.load(f)
+            if datos.get('version') != VERSION_INSTANTANEA:
+                return 0
+            self._terminos = {t: [bytearray(p), ultimo, df] for t, (p, ultimo, df) in datos['terminos'].items()}
+            for nombre in ('_chats', '_fechas', '_tipos', '_posiciones'):
+                getattr(self, nombre).frombytes(datos[nombre])
+            longitudes = np.frombuffer(datos['_longitudes'], dtype=np.uint32)
+            self._longitudes = np.zeros(max(1024, 2 * longitudes.size), dtype=np.uint32)
+            self._longitudes[:longitudes.size] = longitudes
+            self._total_longitud = datos['total_longitud']
+            self._documentos_instantanea = len(self._chats)
+            return datos['fin_documentos']
+        except Exception as e:
+            logger.error("Could not load search snapshot, rebuilding from the log: %s", e)
+            self._vaciar()
+            return 0
+
+    def guardar(self):
+        """Write an atomic snapshot of the index covering everything logged so far."""
+        if self._archivo is None:
+            return
+        with self._lock:
+            self._archivo.flush()
+            datos = {
+                'version': VERSION_INSTANTANEA,
+                'fin_documentos': self._archivo.tell(),
+                'terminos': {t: (bytes(p), ultimo, df) for t, (p, ultimo, df) in self._terminos.items()},
+                'total_longitud': self._total_longitud
+            }
+            for nombre in ('_chats', '_fechas', '_tipos', '_posiciones'):
+                datos[nombre] = getattr(self, nombre).tobytes()
+            datos['_longitudes'] = self._longitudes[:len(self._chats)].tobytes()
+            documentos = len(self._chats)
+        temporal = self.ruta_instantanea + '.tmp'
+        with open(temporal, 'wb') as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, self.ruta_instantanea)
+        with self._lock:
+            self._documentos_instantanea = documentos
+            self._desde_instantanea = time.monotonic() if len(self._chats) > documentos else None
+
+    async def guardar_periodicamente(self, intervalo=REVISION_INSTANTANEA_SEGUNDOS,
+                                     documentos=BUSQUEDA_INSTANTANEA_DOCUMENTOS,
+                                     segundos=BUSQUEDA_INSTANTANEA_SEGUNDOS):
+        """
+        Rewrite the snapshot in a worker thread once enough documents or time accumulated
+        since the last one, so a crash only re-indexes a short log tail on the next boot.
+        """
+        while True:
+            await asyncio.sleep(intervalo)
+            nuevos = len(self) - self._documentos_instantanea
+            if nuevos <= 0:
+                continue
+            if nuevos >= documentos or time.monotonic() - self._desde_instantanea >= segundos:
+                try:
+                    await asyncio.to_thread(self.guardar)
+                except Exception as e:
+                    logger.error("Error writing search snapshot: %s", e)
+
+    def _agregar(self, chat_id, fecha, tipo, texto, posicion):
+        """Add one document to the in-memory index. Caller holds the lock or owns the index."""
+        doc_id = len(self._chats)
+        frecuencias = {}
+        tokens = tokenizar(texto)
+        for token in tokens:
+            frecuencias[token] = frecuencias.get(token, 0) + 1
+        for token, tf in frecuencias.items():
+            entrada = self._terminos.get(token)
+            if entrada is None:
+                entrada = self._terminos[token] = [bytearray(), 0, 0]
+            _codificar(entrada[0], doc_id - entrada[1])
+            _codificar(entrada[0], tf)
+            entrada[1] = doc_id
+            entrada[2] += 1
+        self._chats.append(chat_id)
+        self._fechas.append(fecha)
+        self._tipos.append(tipo)
+        self._posiciones.append(posicion)
+        if doc_id == self._longitudes.size:
+            crecido = np.zeros(2 * doc_id, dtype=np.uint32)
+            crecido[:doc_id] = self._longitudes
+            self._longitudes = crecido
+        self._longitudes[doc_id] = len(tokens)
+        self._total_longitud += len(tokens)
+        if self._desde_instantanea is None:
+            self._desde_instantanea = time.monotonic()
+
+    def indexar(self, chat_id, texto, tipo=PREGUNTA, fecha=None):
+        """Log and index a question or answer; errors are logged, not raised."""
+        if not texto or self._archivo is None:
+            return
+        try:
+            fecha = fecha or time.time()
+            codificado = texto.encode('utf-8')
+            with self._lock:
+                posicion = self._archivo.tell()
+                self._archivo.write(CABECERA_DOCUMENTO.pack(chat_id, fecha, tipo, len(codificado)) + codificado)
+                self._archivo.flush()
+                self._agregar(chat_id, fecha, tipo, texto, posicion)
+        except Exception as e:
+            logger.error("Error indexing message from %s: %s", chat_id, e)
+
+    def buscar(self, consulta, pagina=1, por_pagina=RESULTADOS_POR_PAGINA):
+        """Return (total hits, [(score, doc_id)]) for one page of BM25-ranked results."""
+        terminos = set(tokenizar(consulta))
+        with self._lock:
+            # Copy just what is needed; decoding and scoring happen without blocking indexar()
+            postings = [(bytes(e[0]), e[2]) for e in (self._terminos.get(t) for t in terminos) if e]
+            total_docs = len(self._chats)
+            total_longitud = self._total_longitud
+            # Entries below total_docs never change, and growing swaps in a new array
+            longitudes = self._longitudes[:total_docs]
+        if not postings or not total_docs:
+            return 0, []
+
+        k1, b = self.k1, self.b
+        longitud_media = total_longitud / total_docs or 1.0
+        documentos, puntajes = [], []
+        for datos, df in postings:
+            doc_ids, tf = decodificar_postings(datos)
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            normas = k1 * (1 - b + b * longitudes[doc_ids] / longitud_media)
+            documentos.append(doc_ids)
+            puntajes.append(idf * tf * (k1 + 1) / (tf + normas))
+        if len(documentos) == 1:
+            unicos, totales = documentos[0], puntajes[0]
+        else:
+            # Sum the per-term scores of each document (doc_ids are dense, so bincount beats sorting)
+            totales = np.bincount(np.concatenate(documentos), weights=np.concatenate(puntajes), minlength=total_docs)
+            unicos = np.flatnonzero(totales)
+            totales = totales[unicos]
+
+        cuantos = min(pagina * por_pagina, unicos.size)
+        mejores = np.argpartition(-totales, cuantos - 1)[:cuantos] if cuantos < unicos.size else np.arange(unicos.size)
+        # Best score first, newest document first on ties
+        mejores = mejores[np.lexsort((-unicos[mejores], -totales[mejores]))]
+        pagina_actual = mejores[(pagina - 1) * por_pagina:]
+        return int(unicos.size), [(float(totales[i]), int(unicos[i])) for i in pagina_actual]
+
+    def documento(self, doc_id):
+        """Return (chat_id, timestamp, kind, text) of a document, reading the text from disk."""
+        with self._lock:
+            chat_id = self._chats[doc_id]
+            fecha = self._fechas[doc_id]
+            tipo = self._tipos[doc_id]
+            posicion = self._posiciones[doc_id]
+            self._archivo.flush()
+        with open(self.ruta_documentos, 'rb') as f:
+            f.seek(posicion)
+            longitud = CABECERA_DOCUMENTO.unpack(f.read(CABECERA_DOCUMENTO.size))[3]
+            texto = f.read(longitud).decode('utf-8', 'replace')
+        return chat_id, fecha, tipo, texto
+
+indice = Proxy('busqueda')  # Search index of the current tenant
+
+def indexar(chat_id, texto, tipo=PREGUNTA):
+    """Index a message in the current tenant's search index."""
+    indice.indexar(chat_id, texto, tipo)
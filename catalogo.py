@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+from types import MappingProxyType
+
+from config import CATALOGO_INTERVALO_SEGUNDOS, TIPO_SESION_ESTANDAR, TIPO_SESION_EXTENDIDA
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Session behaviour is implemented in code, so the catalog can only price and label these
+TIPOS_SESION_SOPORTADOS = (TIPO_SESION_ESTANDAR, TIPO_SESION_EXTENDIDA)
+
+class CatalogoInvalido(ValueError):
+    """The catalog file is missing fields or inconsistent."""
+
+class Catalogo:
+    """
+    Immutable, precompiled view of one catalog version.
+
+    Handlers grab one snapshot with actual() and use it for the whole message, so a
+    reload mid-handler never mixes two versions. Every lookup is a plain dict access.
+    """
+
+    __slots__ = (
+        'version', 'servicios_por_etiqueta', 'sesiones_por_etiqueta', 'precios',
+        'nombres_servicio', 'nombres_sesion', 'resumenes', 'codigos_servicio',
+        'teclado_servicios', 'teclado_sesiones'
+    )
+
+    def __init__(self, datos):
+        if not isinstance(datos, dict):
+            raise CatalogoInvalido("the catalog must be a JSON object")
+        version = datos.get('version')
+        if not isinstance(version, int) or isinstance(version, bool):
+            raise CatalogoInvalido("'version' must be an integer")
+
+        servicios = _lista(datos, 'servicios')
+        sesiones = _lista(datos, 'sesiones')
+        etiquetas = set()
+
+        servicios_por_etiqueta, nombres_servicio, resumenes, codigos = {}, {}, {}, {}
+        for servicio in servicios:
+            tipo = _texto(servicio, 'tipo')
+            if tipo in nombres_servicio:
+                raise CatalogoInvalido(f"duplicate service '{tipo}'")
+            etiqueta = _etiqueta(servicio, etiquetas)
+            codigo = servicio.get('codigo')
+            if not isinstance(codigo, int) or not 1 <= codigo <= 255 or codigo in codigos.values():
+                raise CatalogoInvalido(f"service '{tipo}' needs a unique 'codigo' between 1 and 255")
+            servicios_por_etiqueta[etiqueta] = tipo
+            nombres_servicio[tipo] = _texto(servicio, 'nombre')
+            resumenes[tipo] = _texto(servicio, 'resumen')
+            codigos[tipo] = codigo
+
+        sesiones_por_etiqueta, nombres_sesion, precios = {}, {}, {}
+        etiquetas_sesion = {}
+        for sesion in sesiones:
+            tipo = _texto(sesion, 'tipo')
+            if tipo not in TIPOS_SESION_SOPORTADOS:
+                raise CatalogoInvalido(f"unknown session type '{tipo}' (supported: {', '.join(TIPOS_SESION_SOPORTADOS)})")
+            if tipo in nombres_sesion:
+                raise CatalogoInvalido(f"duplicate session '{tipo}'")
+            precio = sesion.get('precio')
+            if not isinstance(precio, (int, float)) or isinstance(precio, bool) or precio <= 0:
+                raise CatalogoInvalido(f"session '{tipo}' needs a positive 'precio'")
+            etiqueta = _etiqueta(sesion, etiquetas)
+            sesiones_por_etiqueta[etiqueta] = tipo
+            etiquetas_sesion[tipo] = etiqueta
+            nombres_sesion[tipo] = _texto(sesion, 'nombre')
+            precios[tipo] = float(precio)
+
+        etiquetas_servicio = {tipo: etiqueta for etiqueta, tipo in servicios_por_etiqueta.items()}
+        filas = datos.get('teclado_servicios') or [[tipo] for tipo in nombres_servicio]
+        try:
+            teclado_servicios = tuple(tuple(etiquetas_servicio[tipo] for tipo in fila) for fila in filas)
+        except (KeyError, TypeError):
+            raise CatalogoInvalido("'teclado_servicios' must be rows of known service types")
+
+        self.version = version
+        self.servicios_por_etiqueta = MappingProxyType(servicios_por_etiqueta)
+        self.sesiones_por_etiqueta = MappingProxyType(sesiones_por_etiqueta)
+        self.precios = MappingProxyType(precios)
+        self.nombres_servicio = MappingProxyType(nombres_servicio)
+        self.nombres_sesion = MappingProxyType(nombres_sesion)
+        self.resumenes = MappingProxyType(resumenes)
+        self.codigos_servicio = MappingProxyType(codigos)
+        self.teclado_servicios = teclado_servicios
+        self.teclado_sesiones = tuple((etiqueta,) for etiqueta in etiquetas_sesion.values())
+
+def _lista(datos, clave):
+    valor = datos.get(clave)
+    if not isinstance(valor, list) or not valor or not all(isinstance(v, dict) for v in valor):
+        raise CatalogoInvalido(f"'{clave}' must be a non-empty list of objects")
+    return valor
+
+def _texto(entrada, clave):
+    valor = entrada.get(clave)
+    if not isinstance(valor, str) or not valor.strip():
+        raise CatalogoInvalido(f"missing text field '{clave}' in {entrada}")
+    return valor
+
+def _etiqueta(entrada, vistas):
+    """Menu labels are matched against user text, so they must be unique across the whole catalog."""
+    etiqueta = _texto(entrada, 'etiqueta')
+    if etiqueta in vistas:
+        raise CatalogoInvalido(f"duplicate menu label '{etiqueta}'")
+    vistas.add(etiqueta)
+    return etiqueta
+
+def compilar(ruta):
+    """Read, validate and compile a catalog file. Returns (catalog, file signature)."""
+    with open(ruta, 'rb') as f:
+        estado = os.fstat(f.fileno())
+        contenido = f.read()
+    try:
+        datos = json.loads(contenido)
+    except ValueError as e:
+        raise CatalogoInvalido(f"invalid JSON: {e}")
+    return Catalogo(datos), (estado.st_mtime_ns, estado.st_size)
+
+class GestorCatalogo:
+    """Holds the active catalog and swaps it atomically when the file changes."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._actual = None
+        self._firma = None
+        self.recargas = 0
+
+    def actual(self):
+        """Current catalog snapshot (compiled on first use)."""
+        catalogo = self._actual
+        if catalogo is None:
+            catalogo, self._firma = compilar(self.ruta)
+            self._actual = catalogo
+            logger.info("Catalog v%s loaded from %s.", catalogo.version, self.ruta)
+        return catalogo
+
+    def recargar(self):
+        """Recompile the file and swap it in. Returns (ok, message); the old catalog stays on error."""
+        anterior = self._actual
+        try:
+            catalogo, firma = compilar(self.ruta)
+        except (OSError, CatalogoInvalido) as e:
+            logger.error("Catalog reload rejected, keeping v%s: %s", anterior.version if anterior else None, e)
+            return False, str(e)
+        # Single reference assignment: readers see either the old or the new snapshot, never a mix
+        self._actual = catalogo
+        self._firma = firma
+        self.recargas += 1
+        logger.info("Catalog reloaded: v%s -> v%s.", anterior.version if anterior else None, catalogo.version)
+        return True, f"v{catalogo.version}"
+
+    def _firma_disco(self):
+        """(mtime, size) of the file on disk, or None if it cannot be read."""
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+
+    async def vigilar(self, intervalo=CATALOGO_INTERVALO_SEGUNDOS):
+        """Poll the file and reload it in a worker thread whenever it changes."""
+        while True:
+            await asyncio.sleep(intervalo)
+            firma = self._firma_disco()
+            if firma is not None and firma != self._firma:
+                # Remember the signature even if the reload fails, so a broken file is reported once
+                self._firma = firma
+                await asyncio.to_thread(self.recargar)
+
+gestor = Proxy('catalogo')  # Catalog of the current tenant
+
+def actual():
+    """Current catalog snapshot."""
+    return gestor.actual()
@@ -1,4 +1,5 @@
 import os
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -7,11 +8,19 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 YOUR_TELEGRAM_ID = os.environ.get('YOUR_TELEGRAM_ID')
 
+def secreto_webhook(token):
+    """Webhook secret derived from a bot token (valid X-Telegram-Bot-Api-Secret-Token charset)."""
+    return hashlib.sha256(token.encode()).hexdigest() if token else None
+
+# Secret Telegram echoes in X-Telegram-Bot-Api-Secret-Token (1-256 chars of A-Z, a-z, 0-9, _ and -).
+# Without WEBHOOK_SECRET one is derived from the bot token, so the check is never off.
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secreto_webhook(TELEGRAM_TOKEN)
+
 if YOUR_TELEGRAM_ID:
     try:
         YOUR_TELEGRAM_ID = int(YOUR_TELEGRAM_ID)
     except ValueError:
-        logger.error(f"YOUR_TELEGRAM_ID '{YOUR_TELEGRAM_ID}' is not a valid number.")
+        logger.error("YOUR_TELEGRAM_ID '%s' is not a valid number.", YOUR_TELEGRAM_ID)
         YOUR_TELEGRAM_ID = None
 
 # Payment Information
@@ -26,35 +35,149 @@ if TASA_BCV_STR:
     try:
         TASA_BCV = float(TASA_BCV_STR_CLEAN)
     except ValueError:
-        logger.error(f"Could not convert TASA_BCV '{TASA_BCV_STR}' to number. Using default value 36.50")
+        logger.error("Could not convert TASA_BCV '%s' to number. Using default value 36.50", TASA_BCV_STR)
         TASA_BCV = 36.50
 else:
     TASA_BCV = 36.50
 
-# Session Types and Prices
+# Session Types
 TIPO_SESION_ESTANDAR = "sesion_estandar"
 TIPO_SESION_EXTENDIDA = "sesion_extendida"
 
-MENU_OPCIONES_A_TIPO = {
-    '⭐ Sesión Estándar (2$)': TIPO_SESION_ESTANDAR,
-    '💎 Sesión Extendida (4$)': TIPO_SESION_EXTENDIDA
-}
-
-PRECIO_SESION = {
-    TIPO_SESION_ESTANDAR: 2.0,
-    TIPO_SESION_EXTENDIDA: 4.0
-}
+# Menu labels, prices, names and descriptions live in the hot-reloaded catalog (catalogo.json)
 
 # Session Configuration
 TIEMPO_SESION_EXTENDIDA_MINUTOS = 20
 
-# Service Types
-SERVICIO_COACH = "coach_motivacional"
-SERVICIO_APOYO = "apoyo_emocional"
-SERVICIO_DOCENTES = "ayuda_docentes"
+# Operator Pool Configuration
+# Format: "chat_id:rol[:servicio[=peso],...];..." e.g. "111:admin;222:operador:apoyo_emocional=2,ayuda_docentes"
+ROL_ADMIN = "admin"
+ROL_OPERADOR = "operador"
+
+def parsear_operadores(texto, admin_id=None):
+    """Parse the operator pool format into {chat_id: {'rol', 'servicios'}}; admin_id is always an admin."""
+    operadores = {}
+    for entrada in (texto or '').split(';'):
+        partes = entrada.strip().split(':')
+        if not partes[0]:
+            continue
+        try:
+            operador_id = int(partes[0])
+        except ValueError:
+            logger.error("Operator ID '%s' is not a valid number. Skipping.", partes[0])
+            continue
+        rol = partes[1].strip() if len(partes) > 1 and partes[1].strip() else ROL_OPERADOR
+        if rol not in (ROL_ADMIN, ROL_OPERADOR):
+            logger.error("Unknown role '%s' for operator %s. Using '%s'.", rol, operador_id, ROL_OPERADOR)
+            rol = ROL_OPERADOR
+        servicios = {}
+        if len(partes) > 2 and partes[2].strip():
+            for habilidad in partes[2].split(','):
+                servicio, _, peso = habilidad.strip().partition('=')
+                try:
+                    servicios[servicio] = float(peso) if peso else 1.0
+                except ValueError:
+                    logger.error("Invalid weight '%s' for %s on operator %s. Using 1.0", peso, servicio, operador_id)
+                    servicios[servicio] = 1.0
+        operadores[operador_id] = {'rol': rol, 'servicios': servicios}
+
+    # The configured owner is always part of the pool as admin
+    if admin_id and admin_id not in operadores:
+        operadores[admin_id] = {'rol': ROL_ADMIN, 'servicios': {}}
+    return operadores
+
+OPERADORES = parsear_operadores(os.environ.get('OPERADORES'), YOUR_TELEGRAM_ID)
+
+TIEMPO_REASIGNACION_STR = os.environ.get('TIEMPO_REASIGNACION_MINUTOS', '10')
+try:
+    TIEMPO_REASIGNACION_MINUTOS = float(TIEMPO_REASIGNACION_STR)
+except ValueError:
+    logger.error("Could not convert TIEMPO_REASIGNACION_MINUTOS '%s'. Using default value 10", TIEMPO_REASIGNACION_STR)
+    TIEMPO_REASIGNACION_MINUTOS = 10.0
+
+# Pending Question Priority Configuration
+SLA_PREGUNTA_STR = os.environ.get('SLA_PREGUNTA_MINUTOS', '15')
+try:
+    SLA_PREGUNTA_MINUTOS = float(SLA_PREGUNTA_STR)
+except ValueError:
+    logger.error("Could not convert SLA_PREGUNTA_MINUTOS '%s'. Using default value 15", SLA_PREGUNTA_STR)
+    SLA_PREGUNTA_MINUTOS = 15.0
+
+ALERTA_RIESGO_STR = os.environ.get('ALERTA_RIESGO_MINUTOS', '5')
+try:
+    ALERTA_RIESGO_MINUTOS = float(ALERTA_RIESGO_STR)
+except ValueError:
+    logger.error("Could not convert ALERTA_RIESGO_MINUTOS '%s'. Using default value 5", ALERTA_RIESGO_STR)
+    ALERTA_RIESGO_MINUTOS = 5.0
+
+# Data Storage Configuration
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+
+EVENTOS_SEGMENTO_STR = os.environ.get('EVENTOS_SEGMENTO_MAX_REGISTROS', '1000000')
+try:
+    EVENTOS_SEGMENTO_MAX_REGISTROS = int(EVENTOS_SEGMENTO_STR)
+except ValueError:
+    logger.error("Could not convert EVENTOS_SEGMENTO_MAX_REGISTROS '%s'. Using default value 1000000", EVENTOS_SEGMENTO_STR)
+    EVENTOS_SEGMENTO_MAX_REGISTROS = 1000000
+
+BITACORA_MAX_MB_STR = os.environ.get('BITACORA_MAX_MB', '64')
+try:
+    BITACORA_MAX_BYTES = int(float(BITACORA_MAX_MB_STR) * 1024 * 1024)
+except ValueError:
+    logger.error("Could not convert BITACORA_MAX_MB '%s'. Using default value 64", BITACORA_MAX_MB_STR)
+    BITACORA_MAX_BYTES = 64 * 1024 * 1024
+
+# HTTP Transport Configuration (separate pools for text messages and media)
+def _leer_numero(nombre, defecto, tipo=float):
+    """Read a numeric environment variable, falling back to the default on bad values."""
+    valor = os.environ.get(nombre)
+    if not valor:
+        return defecto
+    try:
+        return tipo(valor.replace(',', '.'))
+    except ValueError:
+        logger.error("Could not convert %s '%s'. Using default value %s", nombre, valor, defecto)
+        return defecto
+
+HTTP_VERSION = os.environ.get('HTTP_VERSION', '2')
+HTTP_KEEPALIVE_SEGUNDOS = _leer_numero('HTTP_KEEPALIVE_SEGUNDOS', 30.0)
+
+HTTP_POOL_MENSAJES = _leer_numero('HTTP_POOL_MENSAJES', 32, int)
+HTTP_TIMEOUT_MENSAJES = _leer_numero('HTTP_TIMEOUT_MENSAJES', 15.0)
+HTTP_POOL_TIMEOUT_MENSAJES = _leer_numero('HTTP_POOL_TIMEOUT_MENSAJES', 5.0)
+
+HTTP_POOL_MEDIA = _leer_numero('HTTP_POOL_MEDIA', 8, int)
+HTTP_TIMEOUT_MEDIA = _leer_numero('HTTP_TIMEOUT_MEDIA', 60.0)
+HTTP_POOL_TIMEOUT_MEDIA = _leer_numero('HTTP_POOL_TIMEOUT_MEDIA', 30.0)
+
+# Logging Configuration
+# LOG_MUESTREO keeps a fraction of high-volume events, e.g. "pregunta_recibida=0.1,respuesta_enviada=0.5"
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO').upper()
+LOG_MUESTREO = os.environ.get('LOG_MUESTREO', '')
+LOG_COLA_MAX = _leer_numero('LOG_COLA_MAX', 10000, int)
+
+# Flood Protection Configuration (per-chat token bucket)
+FLOOD_RAFAGA = _leer_numero('FLOOD_RAFAGA', 5.0)
+FLOOD_SEGUNDOS_POR_MENSAJE = _leer_numero('FLOOD_SEGUNDOS_POR_MENSAJE', 3.0)
+FLOOD_MAX_INFRACCIONES = _leer_numero('FLOOD_MAX_INFRACCIONES', 10, int)
+FLOOD_SILENCIO_MINUTOS = _leer_numero('FLOOD_SILENCIO_MINUTOS', 10.0)
+
+# Service Catalog Configuration (hot-reloaded)
+CATALOGO_RUTA = os.environ.get('CATALOGO_RUTA', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalogo.json'))
+CATALOGO_INTERVALO_SEGUNDOS = _leer_numero('CATALOGO_INTERVALO_SEGUNDOS', 5.0)
+
+# Multi-tenant Configuration
+# JSON list of bots served by this process; without it the single bot above is used
+TENANTS_RUTA = os.environ.get('TENANTS_RUTA')
+
+# Search Index Configuration
+# The index snapshot is rewritten once this many documents were added, or this many seconds after the first new one
+BUSQUEDA_INSTANTANEA_DOCUMENTOS = _leer_numero('BUSQUEDA_INSTANTANEA_DOCUMENTOS', 1000, int)
+BUSQUEDA_INSTANTANEA_SEGUNDOS = _leer_numero('BUSQUEDA_INSTANTANEA_SEGUNDOS', 300.0)
 
-MENU_SERVICIOS_A_TIPO = {
-    '🚀 Coach Motivacional': SERVICIO_COACH,
-    '💙 Apoyo Emocional': SERVICIO_APOYO,
-    '📚 Ayuda para Docentes': SERVICIO_DOCENTES
-}
+# Event Loop Watchdog Configuration
+# The loop counts as stalled when its heartbeat is WATCHDOG_BLOQUEO_SEGUNDOS late; /ready then answers 503
+WATCHDOG_INTERVALO_SEGUNDOS = _leer_numero('WATCHDOG_INTERVALO_SEGUNDOS', 1.0)
+WATCHDOG_LAG_SEGUNDOS = _leer_numero('WATCHDOG_LAG_SEGUNDOS', 0.5)
+WATCHDOG_BLOQUEO_SEGUNDOS = _leer_numero('WATCHDOG_BLOQUEO_SEGUNDOS', 10.0)
+WATCHDOG_HANDLER_SEGUNDOS = _leer_numero('WATCHDOG_HANDLER_SEGUNDOS', 60.0)
@@ -0,0 +1,173 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import re
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+
+from entrega import LIMITE_MENSAJE
+
+DIRECTORIO_BOT = os.path.dirname(os.path.abspath(__file__))
+MAX_SEGUNDOS = 300
+TOP = 15
+
+# Where the loop thread sits while waiting for I/O (C functions as named by cProfile)
+ESPERAS_IO = frozenset((
+    "<method 'poll' of 'select.epoll' objects>",
+    "<method 'poll' of 'select.poll' objects>",
+    "<method 'control' of 'select.kqueue' objects>",
+    "<built-in method select.select>",
+))
+
+PATRON_DURACION = re.compile(r'^(\d+)\s*([sm]?)$')
+
+# One diagnosis at a time: they are costly and would skew each other
+_ocupado = threading.Lock()
+
+def parsear_duracion(texto, defecto):
+    """Parse '30s', '2m' or '45' into seconds, capped at MAX_SEGUNDOS. None if invalid."""
+    if not texto:
+        return defecto
+    coincidencia = PATRON_DURACION.match(texto.strip().lower())
+    if not coincidencia:
+        return None
+    segundos = int(coincidencia.group(1)) * (60 if coincidencia.group(2) == 'm' else 1)
+    return min(segundos, MAX_SEGUNDOS) if segundos > 0 else None
+
+def ocupado():
+    """True while a profile or memory window is running."""
+    return _ocupado.locked()
+
+def _nombre(clave):
+    archivo, linea, funcion = clave
+    if archivo == '~':
+        return funcion
+    if archivo.startswith(DIRECTORIO_BOT):
+        archivo = os.path.relpath(archivo, DIRECTORIO_BOT)
+    else:
+        archivo = os.path.basename(archivo)
+    return f"{archivo}:{linea} {funcion}"
+
+def _del_bot(clave):
+    return clave[0].startswith(DIRECTORIO_BOT) and not clave[0].endswith('diagnostico.py')
+
+async def perfilar(segundos):
+    """
+    Profile the event loop thread for a window and return a text report, or None if
+    another diagnosis is running. Must be awaited from the loop.
+
+    The profiler hooks only the thread that enables it, so it sees every handler step run
+    by the loop (a sampling thread would need the GIL and miss the short bursts handlers
+    are made of), and it is fully removed when the window ends.
+    """
+    if not _ocupado.acquire(blocking=False):
+        return None
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            perfil.disable()
+    finally:
+        _ocupado.release()
+
+    estadisticas = pstats.Stats(perfil).stats  # (file, line, name) -> (calls, ncalls, own, cumulative, callers)
+    espera = sum(datos[2] for clave, datos in estadisticas.items() if clave[2] in ESPERAS_IO)
+    ocupado_s = max(sum(datos[2] for datos in estadisticas.values()) - espera, 1e-9)
+
+    lineas = [
+        f"Perfil del event loop ({segundos} s)",
+        f"Loop ocupado: {ocupado_s:.2f} s ({100 * ocupado_s / segundos:.1f}% del tiempo)",
+        "",
+        "Funciones del bot (tiempo acumulado · llamadas):"
+    ]
+    del_bot = sorted((c for c in estadisticas if _del_bot(c)), key=lambda c: -estadisticas[c][3])
+    for clave in del_bot[:TOP]:
+        llamadas, _, _, acumulado, _ = estadisticas[clave]
+        lineas.append(f"  {acumulado * 1000:9.1f} ms  {llamadas:7d}  {_nombre(clave)}")
+    lineas += ["", "Todas las funciones (tiempo propio · llamadas):"]
+    propias = sorted((c for c in estadisticas if c[2] not in ESPERAS_IO), key=lambda c: -estadisticas[c][2])
+    for clave in propias[:TOP]:
+        llamadas, _, propio, _, _ = estadisticas[clave]
+        lineas.append(f"  {propio * 1000:9.1f} ms  {llamadas:7d}  {_nombre(clave)}")
+    return "\n".join(lineas)
+
+def _contar_objetos(tenant):
+    """Sizes of the in-memory state of a tenant and of the process."""
+    sesiones = list(tenant.conversaciones_usuarios.values())
+    tareas = asyncio.all_tasks()
+    por_corrutina = Counter(t.get_coro().__qualname__ for t in tareas if hasattr(t.get_coro(), '__qualname__'))
+    conteos = [
+        ("Sesiones (conversaciones_usuarios)", len(sesiones)),
+        ("Entradas de historial", sum(len(s.get('conversation_history', ())) for s in sesiones)),
+        ("Pagos pendientes", len(tenant.pagos_pendientes)),
+        ("Preguntas pendientes", len(tenant.preguntas_pendientes)),
+        ("Tickets abiertos", len(tenant.pool.tickets)),
+        ("Notificaciones indexadas", len(tenant.notificaciones_admin)),
+        ("Última interacción (chats)", len(tenant.user_last_interaction)),
+        ("Chats en el antiflood", len(tenant.limitador)),
+        ("Documentos en el buscador", len(tenant.busqueda)),
+        ("Tareas asyncio", len(tareas)),
+    ]
+    return conteos, por_corrutina
+
+async def memoria(segundos, tenant):
+    """
+    Trace allocations for a window and return a text report with the top allocation
+    sites still alive at the end, plus counts of the bot's in-memory structures.
+    Returns None if another diagnosis is running.
+    """
+    if not _ocupado.acquire(blocking=False):
+        return None
+    ya_activo = tracemalloc.is_tracing()
+    try:
+        if not ya_activo:
+            tracemalloc.start(1)
+        await asyncio.sleep(segundos)
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        actual, pico = tracemalloc.get_traced_memory()
+    finally:
+        if not ya_activo:
+            tracemalloc.stop()
+        _ocupado.release()
+
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    estadisticas = await asyncio.to_thread(snapshot.statistics, 'lineno')
+    conteos, por_corrutina = _contar_objetos(tenant)
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    lineas = [
+        f"Memoria ({segundos} s de trazado{', ya estaba activo' if ya_activo else ''})",
+        f"RSS máximo: {rss_mb:.1f} MB · trazado: {actual / 1048576:.1f} MB (pico {pico / 1048576:.1f} MB)",
+        "",
+        "Estado en memoria:"
+    ]
+    lineas += [f"  {nombre}: {valor}" for nombre, valor in conteos]
+    lineas += ["", "Tareas por corrutina:"]
+    lineas += [f"  {n:6d}  {nombre}" for nombre, n in por_corrutina.most_common(TOP)]
+    lineas += ["", "Sitios de asignación vivos (creados durante la ventana):"]
+    for estadistica in estadisticas[:TOP]:
+        marco = estadistica.traceback[0]
+        lineas.append(
+            f"  {estadistica.size / 1024:8.1f} KiB  {estadistica.count:7d} obj  "
+            f"{_nombre((marco.filename, marco.lineno, ''))}".rstrip()
+        )
+    return "\n".join(lineas)
+
+async def enviar_informe(bot, chat_id, nombre_archivo, texto):
+    """Send a report as a message, or as an attached text file when it does not fit in one."""
+    if len(texto) <= LIMITE_MENSAJE:
+        await bot.send_message(chat_id=chat_id, text=texto)
+        return
+    archivo = io.BytesIO(texto.encode('utf-8'))
+    await bot.send_document(chat_id=chat_id, document=archivo, filename=nombre_archivo,
+                            caption=texto.split("\n", 1)[0])
@@ -0,0 +1,74 @@
+import logging
+import re
+import threading
+
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+# update_id is a top-level key; inside strings quotes are escaped, so this cannot match message text
+PATRON_UPDATE_ID = re.compile(rb'"update_id"\s*:\s*(\d+)')
+
+def extraer_update_id(raw):
+    """Read update_id from the raw webhook body without parsing the JSON. Returns None if absent."""
+    coincidencia = PATRON_UPDATE_ID.search(raw)
+    return int(coincidencia.group(1)) if coincidencia else None
+
+class VentanaUpdates:
+    """
+    Sliding bitmap over the most recent update_ids.
+
+    Telegram update IDs are (almost) monotonic, so one bit per ID in a ring of
+    `tamano` slots is enough: moving the window forward clears the slots it passes,
+    and any ID older than the window is treated as an already-seen retry.
+    Memory is tamano / 8 bytes and every check is O(1) amortized.
+    """
+
+    def __init__(self, tamano=65536):
+        self.tamano = tamano
+        self._bits = bytearray(tamano // 8)
+        self._maximo = None
+        self._lock = threading.Lock()
+        self.vistos = 0
+        self.duplicados = 0
+
+    def _limpiar(self, desde, hasta):
+        """Clear slots for IDs in (desde, hasta]."""
+        if hasta - desde >= self.tamano:
+            self._bits = bytearray(self.tamano // 8)
+            return
+        for update_id in range(desde + 1, hasta + 1):
+            slot = update_id % self.tamano
+            self._bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+
+    def registrar(self, update_id):
+        """Record an update_id. Returns True if it is new, False if it is a duplicate."""
+        with self._lock:
+            if self._maximo is None:
+                self._maximo = update_id
+            elif update_id > self._maximo:
+                self._limpiar(self._maximo, update_id)
+                self._maximo = update_id
+            elif update_id <= self._maximo - self.tamano:
+                self.duplicados += 1
+                return False
+
+            slot = update_id % self.tamano
+            mascara = 1 << (slot & 7)
+            if self._bits[slot >> 3] & mascara:
+                self.duplicados += 1
+                return False
+            self._bits[slot >> 3] |= mascara
+            self.vistos += 1
+            return True
+
+    def olvidar(self, update_id):
+        """Forget a registered update_id (it could not be accepted), so Telegram's retry is processed."""
+        with self._lock:
+            if self._maximo is None or update_id <= self._maximo - self.tamano:
+                return
+            slot = update_id % self.tamano
+            self._bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+            self.vistos -= 1
+
+ventana_updates = Proxy('ventana_updates')  # Dedupe window of the current tenant
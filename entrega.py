@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import re
+import weakref
+from functools import lru_cache
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+LIMITE_MENSAJE = 4096
+LIMITE_CAPTION = 1024
+
+PATRON_ESPECIALES = re.compile(r'([_*`\[])')
+PATRON_ORACION = re.compile(r'(?<=[.!?…])\s+')
+
+# One lock per (bot, chat): chunks of one text never interleave with another send to the same chat
+_locks = weakref.WeakValueDictionary()
+
+@lru_cache(maxsize=8192)
+def escapar(texto):
+    """Escape user-provided text for ParseMode.MARKDOWN (legacy), outside of entities."""
+    return PATRON_ESPECIALES.sub(r'\\\1', str(texto))
+
+def escapar_codigo(texto):
+    """Make text safe inside a `code` span, where Markdown cannot be escaped."""
+    return str(texto).replace('`', 'ʼ')
+
+def _trozos(texto, limite, separadores):
+    """Split text at the first separator that yields pieces under the limit, recursing on the rest."""
+    if len(texto) <= limite:
+        return [texto]
+    if not separadores:
+        return [texto[i:i + limite] for i in range(0, len(texto), limite)]
+    separador, resto = separadores[0], separadores[1:]
+    partes = separador.split(texto) if isinstance(separador, re.Pattern) else texto.split(separador)
+    unir = ' ' if isinstance(separador, re.Pattern) else separador
+
+    trozos, actual = [], ''
+    for parte in partes:
+        for pieza in _trozos(parte, limite, resto) if len(parte) > limite else [parte]:
+            if not actual:
+                actual = pieza
+            elif len(actual) + len(unir) + len(pieza) <= limite:
+                actual += unir + pieza
+            else:
+                trozos.append(actual)
+                actual = pieza
+    if actual:
+        trozos.append(actual)
+    return trozos
+
+def dividir(texto, limite=LIMITE_MENSAJE):
+    """Split a long text on paragraphs, then lines, sentences and words, keeping every chunk under limite."""
+    return [t for t in _trozos(texto, limite, ['\n\n', '\n', PATRON_ORACION, ' ']) if t.strip()]
+
+def _es_error_de_formato(error):
+    return "can't parse entities" in str(error).lower() or "can't find end of the entity" in str(error).lower()
+
+def _lock(bot, chat_id):
+    clave = (bot.token, chat_id)
+    lock = _locks.get(clave)
+    if lock is None:
+        lock = _locks[clave] = asyncio.Lock()
+    return lock
+
+async def _enviar_trozo(bot, chat_id, texto, parse_mode, **kwargs):
+    """Send one chunk, retrying as plain text if Telegram cannot parse its formatting."""
+    try:
+        return await bot.send_message(chat_id=chat_id, text=texto, parse_mode=parse_mode, **kwargs)
+    except BadRequest as e:
+        if not parse_mode or not _es_error_de_formato(e):
+            raise
+        logger.warning("Formatting rejected for message to %s, sending as plain text: %s", chat_id, e)
+        return await bot.send_message(chat_id=chat_id, text=texto, **kwargs)
+
+async def enviar_texto(bot, chat_id, texto, parse_mode=None, reply_markup=None, **kwargs):
+    """
+    Send a text of any length, in order, as as many messages as needed.
+    The reply markup goes on the last chunk. Returns the sent messages.
+    """
+    trozos = dividir(texto)
+    enviados = []
+    async with _lock(bot, chat_id):
+        for i, trozo in enumerate(trozos):
+            ultimo = i == len(trozos) - 1
+            enviados.append(await _enviar_trozo(
+                bot, chat_id, trozo, parse_mode, reply_markup=reply_markup if ultimo else None, **kwargs
+            ))
+    return enviados
+
+async def enviar_foto(bot, chat_id, foto, caption, parse_mode=None, reply_markup=None, **kwargs):
+    """
+    Send a photo with a caption of any length: what does not fit in the caption follows as text.
+    Falls back to a plain caption on formatting errors. The reply markup goes on the last message.
+    Returns the sent messages.
+    """
+    trozos = dividir(caption, LIMITE_CAPTION) or ['']
+    resto = dividir('\n\n'.join(trozos[1:]))
+    if not resto:
+        kwargs['reply_markup'] = reply_markup
+    async with _lock(bot, chat_id):
+        try:
+            enviados = [await bot.send_photo(chat_id=chat_id, photo=foto, caption=trozos[0], parse_mode=parse_mode, **kwargs)]
+        except BadRequest as e:
+            if not parse_mode or not _es_error_de_formato(e):
+                raise
+            logger.warning("Formatting rejected for photo to %s, sending caption as plain text: %s", chat_id, e)
+            if hasattr(foto, 'seek'):
+                foto.seek(0)
+            enviados = [await bot.send_photo(chat_id=chat_id, photo=foto, caption=trozos[0], **kwargs)]
+        for i, trozo in enumerate(resto):
+            ultimo = i == len(resto) - 1
+            enviados.append(await _enviar_trozo(
+                bot, chat_id, trozo, parse_mode, reply_markup=reply_markup if ultimo else None
+            ))
+    return enviados
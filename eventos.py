@@ -0,0 +1,158 @@
+import atexit
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+
+from config import EVENTOS_SEGMENTO_MAX_REGISTROS, TIPO_SESION_ESTANDAR, TIPO_SESION_EXTENDIDA
+from tenants import Proxy
+import catalogo
+
+logger = logging.getLogger(__name__)
+
+# Event types (stored as one byte)
+SERVICIO_ELEGIDO = 1
+PAGO_SOLICITADO = 2
+COMPROBANTE_RECIBIDO = 3
+PAGO_CONFIRMADO = 4
+PREGUNTA = 5
+RESPUESTA = 6
+SESION_FINALIZADA = 7
+
+NOMBRES_EVENTOS = {
+    SERVICIO_ELEGIDO: 'servicio_elegido',
+    PAGO_SOLICITADO: 'pago_solicitado',
+    COMPROBANTE_RECIBIDO: 'comprobante_recibido',
+    PAGO_CONFIRMADO: 'pago_confirmado',
+    PREGUNTA: 'pregunta',
+    RESPUESTA: 'respuesta',
+    SESION_FINALIZADA: 'sesion_finalizada'
+}
+
+# Session codes (0 = unknown); service codes come from the catalog ('codigo')
+CODIGOS_SESION = {TIPO_SESION_ESTANDAR: 1, TIPO_SESION_EXTENDIDA: 2}
+
+# Fixed-width little-endian record so segments can be memory-mapped as columns:
+# ts, tipo, servicio, tipo_sesion, padding, chat_id, monto_usd, tasa, valor
+REGISTRO = struct.Struct('<dBBB5xqddd')
+PREFIJO_SEGMENTO = 'eventos-'
+EXTENSION_SEGMENTO = '.bin'
+
+class RegistroEventos:
+    """
+    Append-only event log split into fixed-size binary segments.
+
+    registrar() only packs the record into a buffer; a background thread writes
+    whatever accumulated in one go, so the event loop never waits on the disk.
+    """
+
+    def __init__(self, directorio, max_registros=EVENTOS_SEGMENTO_MAX_REGISTROS):
+        self.directorio = directorio
+        self.max_registros = max_registros
+        self._archivo = None
+        self._numero = 0
+        self._registros = 0
+        self._lock = threading.Lock()  # Guards the open segment; taken before _condicion
+        self._condicion = threading.Condition()
+        self._pendiente = bytearray()
+        self._hilo = None
+
+    def segmentos(self):
+        """Paths of all segments, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directorio, f"{PREFIJO_SEGMENTO}*{EXTENSION_SEGMENTO}")))
+
+    def _abrir(self):
+        """Open the newest segment for appending, dropping any torn record at its end."""
+        os.makedirs(self.directorio, exist_ok=True)
+        segmentos = self.segmentos()
+        if segmentos:
+            ruta = segmentos[-1]
+            self._numero = int(os.path.basename(ruta)[len(PREFIJO_SEGMENTO):-len(EXTENSION_SEGMENTO)])
+            tamano = os.path.getsize(ruta)
+            self._registros = tamano // REGISTRO.size
+            if tamano % REGISTRO.size:
+                with open(ruta, 'r+b') as f:
+                    f.truncate(self._registros * REGISTRO.size)
+            if self._registros >= self.max_registros:
+                self._rotar()
+                return
+        else:
+            self._numero = 1
+            self._registros = 0
+        self._archivo = open(self._ruta(self._numero), 'ab')
+
+    def _ruta(self, numero):
+        return os.path.join(self.directorio, f"{PREFIJO_SEGMENTO}{numero:06d}{EXTENSION_SEGMENTO}")
+
+    def _rotar(self):
+        """Close the current segment and start the next one."""
+        if self._archivo:
+            self._archivo.close()
+        self._numero += 1
+        self._registros = 0
+        self._archivo = open(self._ruta(self._numero), 'ab')
+
+    def registrar(self, tipo, chat_id, servicio=None, tipo_sesion=None, monto_usd=0.0, tasa=0.0, valor=0.0):
+        """Queue one event for writing; errors are logged, not raised."""
+        try:
+            registro = REGISTRO.pack(
+                time.time(), tipo,
+                catalogo.actual().codigos_servicio.get(servicio, 0), CODIGOS_SESION.get(tipo_sesion, 0),
+                chat_id, float(monto_usd or 0), float(tasa or 0), float(valor or 0)
+            )
+        except Exception as e:
+            logger.error("Error encoding event %s for %s: %s", NOMBRES_EVENTOS.get(tipo, tipo), chat_id, e)
+            return
+        with self._condicion:
+            self._pendiente += registro
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escribir, name="registro-eventos", daemon=True)
+                self._hilo.start()
+                atexit.register(self.cerrar)
+            self._condicion.notify()
+
+    def _escribir(self):
+        """Writer thread: append the buffered records in batches."""
+        while True:
+            with self._condicion:
+                while not self._pendiente:
+                    self._condicion.wait()
+            with self._lock:
+                self._volcar()
+
+    def _volcar(self):
+        """Write the buffered records to the segments, rotating as they fill. Caller holds _lock."""
+        with self._condicion:
+            lote = memoryview(self._pendiente)
+            self._pendiente = bytearray()
+        if not lote:
+            return
+        try:
+            if self._archivo is None:
+                self._abrir()
+            while lote:
+                if self._registros >= self.max_registros:
+                    self._rotar()
+                trozo = lote[:(self.max_registros - self._registros) * REGISTRO.size]
+                self._archivo.write(trozo)
+                self._registros += len(trozo) // REGISTRO.size
+                lote = lote[len(trozo):]
+            self._archivo.flush()
+        except Exception as e:
+            logger.error("Error writing %s events: %s", len(lote) // REGISTRO.size, e)
+
+    def cerrar(self):
+        """Write the buffered events and close the open segment."""
+        with self._lock:
+            self._volcar()
+            if self._archivo:
+                self._archivo.close()
+                self._archivo = None
+
+registro = Proxy('eventos')  # Event log of the current tenant
+
+def registrar_evento(tipo, chat_id, **campos):
+    """Append an event to the global log."""
+    registro.registrar(tipo, chat_id, **campos)
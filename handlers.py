@@ -3,32 +3,76 @@ import logging
 import uuid
 import datetime
 import re
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import ContextTypes
+import time
+from telegram import Update, Message, ReplyKeyboardMarkup, ReplyKeyboardRemove, ForceReply
+from telegram.ext import ContextTypes, ApplicationHandlerStop
+from telegram.error import BadRequest
 from telegram.constants import ParseMode
 
-from config import (
-    YOUR_TELEGRAM_ID, NUMERO_TELEFONO, CEDULA_IDENTIDAD, BANCO, TASA_BCV,
-    MENU_OPCIONES_A_TIPO, PRECIO_SESION, MENU_SERVICIOS_A_TIPO,
-    TIPO_SESION_ESTANDAR, TIPO_SESION_EXTENDIDA
-)
+from config import TIPO_SESION_ESTANDAR, TIPO_SESION_EXTENDIDA
 import utils
+import catalogo
+import tenants
+import busqueda
+import eventos
+import acciones
+import diagnostico
+from eventos import registrar_evento
 from utils import (
     pagos_pendientes, conversaciones_usuarios, preguntas_pendientes,
     generate_service_keyboard, generate_session_keyboard, generate_main_menu_keyboard,
     finalizar_sesion_estandar, iniciar_temporizador_extendida,
-    save_temp_file, cleanup_temp_file
+    save_temp_file, cleanup_temp_file, VOLVER_MENU
 )
-from services import notify_admin_user_question, format_service_name, format_session_name
+from services import notify_admin_user_question, programar_refresco, format_service_name, format_session_name
+from operators import pool, vigilar_ticket, TICKET_PAGO, TICKET_PREGUNTA
+from duplicados import ventana_updates
+from transporte import transporte
+from entrega import enviar_texto, enviar_foto, escapar, escapar_codigo
+from limitador import limitador, PERMITIDO, EXCESO, RECIEN_SILENCIADO
+import logs
+from logs import evento
+from vigia import vigia
 
 logger = logging.getLogger(__name__)
 
-# Diccionario con los resúmenes empáticos para cada servicio
-RESUMEN_SERVICIOS = {
-    'coach_motivacional': '🚀 Te acompañaré en tu camino hacia el éxito personal y profesional. Juntos identificaremos tus metas, superaremos obstáculos y desbloquearemos todo tu potencial. Cada paso que des será un avance hacia la mejor versión de ti mismo.',
-    'apoyo_emocional': '💙 Estoy aquí para brindarte un espacio seguro donde puedas expresarte libremente. Te ofrezco comprensión, herramientas de bienestar emocional y el acompañamiento que necesitas para encontrar tu equilibrio interior, además descubrir mensajes valiosos de tus sueños pues no son casualidad, sino avisos ocultos de tu alma.',
-    'ayuda_docentes': '📚 Como educador, mereces todo el apoyo para brillar en tu noble labor. Te ayudaré con estrategias pedagógicas innovadoras, manejo del aula y herramientas para potenciar el aprendizaje de tus estudiantes.'
-}
+async def limitar_entrada_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Per-chat flood control, run before any other handler (group -1)."""
+    chat = update.effective_chat
+    if not chat or pool.es_operador(chat.id):
+        return
+
+    estado = limitador.permitir(chat.id)
+    if estado == PERMITIDO:
+        return
+
+    mensaje = update.message
+    texto = mensaje.text if mensaje else None
+    sesion = conversaciones_usuarios.get(chat.id)
+    if estado == EXCESO and texto and sesion and sesion.get('estado') == 'activa':
+        sesion['conversation_history'].append({
+            'timestamp': datetime.datetime.now(),
+            'user_message': texto
+        })
+        busqueda.indexar(chat.id, texto)
+        # Keep what the user said, as part of the question already waiting for an operator
+        entrada = preguntas_pendientes.fusionar(chat.id, texto)
+        if entrada is not None:
+            programar_refresco(context, entrada)
+            evento(logger, 'pregunta_fusionada', nivel=logging.DEBUG, chat_id=chat.id)
+        else:
+            # Nothing queued: it is a new question, but the burst gets no extra acknowledgement
+            await notify_admin_user_question(context, chat.id, sesion['nombre_usuario'], texto)
+            registrar_evento(
+                eventos.PREGUNTA, chat.id,
+                servicio=sesion.get('servicio'), tipo_sesion=sesion.get('tipo_sesion')
+            )
+    elif estado == RECIEN_SILENCIADO and mensaje:
+        evento(logger, 'chat_silenciado', nivel=logging.WARNING, chat_id=chat.id)
+        await mensaje.reply_text(
+            "Has enviado demasiados mensajes seguidos. Podrás volver a escribir en unos minutos. 🙏"
+        )
+    raise ApplicationHandlerStop
 
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command."""
@@ -43,28 +87,29 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"¡Hola {nombre}! 🌟 Bienvenido a Apoyo Integral. Estoy aquí para acompañarte en tu camino de crecimiento y bienestar ¿En qué puedo ayudarte hoy? Elige una opción del menú y comencemos juntos.",
         reply_markup=reply_markup
     )
-    logger.info(f"User {nombre} (ID: {update.message.chat.id}) started the bot.")
+    logger.info("User %s (ID: %s) started the bot.", nombre, update.message.chat.id)
 
-async def mostrar_informacion_pago(update: Update, context: ContextTypes.DEFAULT_TYPE, tipo_sesion_elegida: str, precio_dolares: float):
+async def mostrar_informacion_pago(update: Update, context: ContextTypes.DEFAULT_TYPE, tipo_sesion_elegida: str, precio_dolares: float, cat=None):
     """Show payment information and save pending request."""
     chat_id_usuario = update.message.chat.id
+    tenant = tenants.actual()
 
-    if not all([NUMERO_TELEFONO, CEDULA_IDENTIDAD, BANCO, TASA_BCV]):
+    if not tenant.pago_configurado():
         await update.message.reply_text(
             "Error en la configuración del bot. Los datos de pago no están completos. Por favor, contacta al administrador."
         )
-        logger.error("Missing payment data or BCV rate in configuration.")
+        logger.error("Missing payment data or BCV rate in configuration of tenant %s.", tenant.id)
         return
 
-    precio_bolivares = precio_dolares * TASA_BCV
-    tipo_sesion_formateada = format_session_name(tipo_sesion_elegida)
+    precio_bolivares = precio_dolares * tenant.tasa_bcv
+    tipo_sesion_formateada = format_session_name(tipo_sesion_elegida, cat)
 
     mensaje = (
         f"Para la {tipo_sesion_formateada} ({precio_dolares}$), el monto a pagar es de *{precio_bolivares:.2f} bolívares*.\n\n"
         f"Datos para el pago móvil:\n"
-        f"📱 Número de teléfono: *{NUMERO_TELEFONO}*\n"
-        f"🆔 Cédula de identidad: *{CEDULA_IDENTIDAD}*\n"
-        f"🏦 Banco: *{BANCO}*\n\n"
+        f"📱 Número de teléfono: *{tenant.numero_telefono}*\n"
+        f"🆔 Cédula de identidad: *{tenant.cedula_identidad}*\n"
+        f"🏦 Banco: *{tenant.banco}*\n\n"
         f"Por favor, envía el comprobante de pago con la referencia para confirmar tu sesión."
     )
 
@@ -73,20 +118,24 @@ async def mostrar_informacion_pago(update: Update, context: ContextTypes.DEFAULT
         reply_markup=ReplyKeyboardRemove(),
         parse_mode=ParseMode.MARKDOWN
     )
-    logger.info(f"Payment information shown for {tipo_sesion_formateada}.")
 
-    # Save pending payment info
-    pagos_pendientes[chat_id_usuario] = {
+    # Save pending payment info (keeping the service chosen earlier)
+    pagos_pendientes.setdefault(chat_id_usuario, {}).update({
         'tipo_sesion_elegida': tipo_sesion_elegida,
         'precio_dolares': precio_dolares,
         'nombre_usuario': update.message.from_user.first_name
-    }
-    logger.info(f"Pending payment info saved for {chat_id_usuario}: {pagos_pendientes[chat_id_usuario]}")
+    })
+    registrar_evento(
+        eventos.PAGO_SOLICITADO, chat_id_usuario,
+        servicio=pagos_pendientes[chat_id_usuario].get('servicio'), tipo_sesion=tipo_sesion_elegida,
+        monto_usd=precio_dolares, tasa=tenant.tasa_bcv
+    )
+    evento(logger, 'pago_solicitado', chat_id=chat_id_usuario, tipo_sesion=tipo_sesion_elegida)
 
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle photo receipt verification."""
-    if not YOUR_TELEGRAM_ID or YOUR_TELEGRAM_ID == 1234567890:
-        logger.error("YOUR_TELEGRAM_ID is not configured. Cannot send payment notifications.")
+    if not pool.operadores:
+        logger.error("No operators configured. Cannot send payment notifications.")
         await update.message.reply_text(
             "Error en la configuración del bot. No se pueden enviar notificaciones de pago."
         )
@@ -100,7 +149,7 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(
                 "Por favor, primero selecciona un servicio y tipo de sesión antes de enviar el comprobante."
             )
-            logger.warning(f"Receipt received from {chat_id_usuario} without pending payment info.")
+            logger.warning("Receipt received from %s without pending payment info.", chat_id_usuario)
             return
 
         info_pago_usuario = pagos_pendientes[chat_id_usuario]
@@ -108,46 +157,63 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         precio_dolares = info_pago_usuario['precio_dolares']
 
         # Download the photo
-        photo_file = await update.message.photo[-1].get_file()
+        foto = update.message.photo[-1]
+        photo_file = await foto.get_file()
         file_data = await photo_file.download_as_bytearray()
-        temp_file_path = save_temp_file(file_data)
+        temp_file_path = await asyncio.to_thread(save_temp_file, file_data)
 
         # Send to admin with payment info and clickable command
         caption_mensaje_admin = (
             f"**🔔 Nuevo Comprobante de Pago Pendiente**\n"
-            f"De: {nombre_usuario} (ID: `{chat_id_usuario}`)\n"
+            f"De: {escapar(nombre_usuario)} (ID: `{chat_id_usuario}`)\n"
             f"Servicio: {format_session_name(tipo_sesion_elegida)}\n"
             f"Monto (USD): {precio_dolares}\n\n"
             f"--- Para confirmar y activar la sesión IA, envía tu comando: ---\n"
             f"`/confirmar_pago {chat_id_usuario} {tipo_sesion_elegida}`"
         )
 
-        with open(temp_file_path, 'rb') as photo:
-            await context.bot.send_photo(
-                chat_id=YOUR_TELEGRAM_ID,
-                photo=photo,
-                caption=caption_mensaje_admin,
-                parse_mode=ParseMode.MARKDOWN
-            )
+        ticket, nuevo = pool.crear_ticket(
+            chat_id_usuario, TICKET_PAGO, info_pago_usuario.get('servicio'),
+            mensaje=caption_mensaje_admin, foto=foto.file_id
+        )
+
+        try:
+            with open(temp_file_path, 'rb') as photo:
+                enviados = await enviar_foto(
+                    context.bot, ticket['operador'], photo, caption_mensaje_admin, ParseMode.MARKDOWN,
+                    reply_markup=acciones.teclado(ticket)
+                )
+        except Exception:
+            # Nobody saw it: free the operator's slot so the user's retry opens a fresh ticket
+            if nuevo:
+                pool.cerrar(ticket['id'])
+            raise
+        finally:
+            await asyncio.to_thread(cleanup_temp_file, temp_file_path)
+        for notificacion in enviados:
+            utils.notificaciones_admin.registrar(ticket['operador'], notificacion.message_id, chat_id_usuario, ticket['id'])
 
         await update.message.reply_text(
             "¡Comprobante de pago recibido! Gracias por tu paciencia mientras lo verificamos."
         )
-        logger.info(f"Payment receipt received from {chat_id_usuario} and forwarded to {YOUR_TELEGRAM_ID}.")
-
-        # Cleanup temporary file
-        cleanup_temp_file(temp_file_path)
+        logger.info("Payment receipt received from %s and forwarded to operator %s.", chat_id_usuario, ticket['operador'])
+        registrar_evento(
+            eventos.COMPROBANTE_RECIBIDO, chat_id_usuario,
+            servicio=info_pago_usuario.get('servicio'), tipo_sesion=tipo_sesion_elegida, monto_usd=precio_dolares
+        )
+        if nuevo:
+            asyncio.create_task(vigilar_ticket(context, ticket['id']))
 
     except Exception as e:
-        logger.error(f"Error handling photo for verification: {e}")
+        logger.error("Error handling photo for verification: %s", e)
         await update.message.reply_text(
             "Ocurrió un error al procesar tu comprobante. Por favor, inténtalo de nuevo más tarde."
         )
 
 async def handle_text_payment_reference(update: Update, context: ContextTypes.DEFAULT_TYPE, referencia: str):
     """Handle payment reference sent as text."""
-    if not YOUR_TELEGRAM_ID or YOUR_TELEGRAM_ID == 1234567890:
-        logger.error("YOUR_TELEGRAM_ID is not configured. Cannot send payment notifications.")
+    if not pool.operadores:
+        logger.error("No operators configured. Cannot send payment notifications.")
         await update.message.reply_text(
             "Error en la configuración del bot. No se pueden enviar notificaciones de pago."
         )
@@ -161,7 +227,7 @@ async def handle_text_payment_reference(update: Update, context: ContextTypes.DE
             await update.message.reply_text(
                 "Por favor, primero selecciona un servicio y tipo de sesión antes de enviar la referencia."
             )
-            logger.warning(f"Payment reference received from {chat_id_usuario} without pending payment info.")
+            logger.warning("Payment reference received from %s without pending payment info.", chat_id_usuario)
             return
 
         info_pago_usuario = pagos_pendientes[chat_id_usuario]
@@ -171,34 +237,49 @@ async def handle_text_payment_reference(update: Update, context: ContextTypes.DE
         # Send to admin with payment info and clickable command
         mensaje_admin = (
             f"**🔔 Nueva Referencia de Pago (TEXTO)**\n"
-            f"De: {nombre_usuario} (ID: `{chat_id_usuario}`)\n"
+            f"De: {escapar(nombre_usuario)} (ID: `{chat_id_usuario}`)\n"
             f"Servicio: {format_session_name(tipo_sesion_elegida)}\n"
             f"Monto (USD): {precio_dolares}\n"
-            f"Referencia: `{referencia}`\n\n"
+            f"Referencia: `{escapar_codigo(referencia)}`\n\n"
             f"--- Para confirmar y activar la sesión, envía: ---\n"
             f"`/confirmar_pago {chat_id_usuario} {tipo_sesion_elegida}`"
         )
 
-        await context.bot.send_message(
-            chat_id=YOUR_TELEGRAM_ID,
-            text=mensaje_admin,
-            parse_mode=ParseMode.MARKDOWN
+        ticket, nuevo = pool.crear_ticket(
+            chat_id_usuario, TICKET_PAGO, info_pago_usuario.get('servicio'), mensaje=mensaje_admin
         )
 
+        try:
+            enviados = await enviar_texto(
+                context.bot, ticket['operador'], mensaje_admin, ParseMode.MARKDOWN, reply_markup=acciones.teclado(ticket)
+            )
+        except Exception:
+            if nuevo:
+                pool.cerrar(ticket['id'])
+            raise
+        for notificacion in enviados:
+            utils.notificaciones_admin.registrar(ticket['operador'], notificacion.message_id, chat_id_usuario, ticket['id'])
+
         await update.message.reply_text(
             "¡Referencia de pago recibida! Gracias por tu paciencia mientras verificamos el pago."
         )
-        logger.info(f"Payment reference received from {chat_id_usuario} and forwarded to {YOUR_TELEGRAM_ID}: {referencia}")
+        logger.info("Payment reference received from %s and forwarded to operator %s: %s", chat_id_usuario, ticket['operador'], referencia)
+        registrar_evento(
+            eventos.COMPROBANTE_RECIBIDO, chat_id_usuario,
+            servicio=info_pago_usuario.get('servicio'), tipo_sesion=tipo_sesion_elegida, monto_usd=precio_dolares
+        )
+        if nuevo:
+            asyncio.create_task(vigilar_ticket(context, ticket['id']))
 
     except Exception as e:
-        logger.error(f"Error handling text payment reference: {e}")
+        logger.error("Error handling text payment reference: %s", e)
         await update.message.reply_text(
             "Ocurrió un error al procesar tu referencia. Por favor, inténtalo de nuevo más tarde."
         )
 
 async def confirmar_pago_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle payment confirmation from admin."""
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    """Handle payment confirmation from an operator."""
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
@@ -210,63 +291,119 @@ async def confirmar_pago_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     try:
         chat_id_usuario = int(context.args[0])
-        tipo_sesion_elegida = context.args[1]
+        _, resultado = await activar_sesion(context, update.message.chat.id, chat_id_usuario, context.args[1])
+        await update.message.reply_text(resultado)
 
-        if chat_id_usuario not in pagos_pendientes:
-            await update.message.reply_text(
-                f"No se encontró información de pago pendiente para el usuario {chat_id_usuario}."
-            )
-            return
+    except ValueError:
+        await update.message.reply_text("El chat_id debe ser un número válido.")
+    except Exception as e:
+        logger.error("Error confirming payment: %s", e)
+        await update.message.reply_text("Error al confirmar el pago. Por favor, intenta de nuevo.")
 
-        info_pago = pagos_pendientes[chat_id_usuario]
-        nombre_usuario = info_pago['nombre_usuario']
-
-        # Activate session
-        conversaciones_usuarios[chat_id_usuario] = {
-            'tipo_sesion': tipo_sesion_elegida,
-            'nombre_usuario': nombre_usuario,
-            'conversation_history': [],
-            'estado': 'activa',
-            'servicio': info_pago.get('servicio', 'coach_motivacional')
-        }
-
-        # Remove from pending payments
-        del pagos_pendientes[chat_id_usuario]
-
-        # Send confirmation to user
-        session_name = format_session_name(tipo_sesion_elegida)
-        mensaje_usuario = (
-            f"¡Perfecto, {nombre_usuario}! Tu pago ha sido confirmado y activado. ✅\n\n"
-            f"Ahora puedes hacer todas las preguntas que necesites. Estoy aquí para ayudarte. 😊"
-        
-        )
+async def activar_sesion(context, operador_id, chat_id_usuario, tipo_sesion_elegida):
+    """
+    Claim a user's payment ticket, activate the paid session and tell the user.
+    Returns (ok, message for the operator); ok is False if there is nothing to confirm
+    or another operator is already handling the payment.
+    """
+    if chat_id_usuario not in pagos_pendientes:
+        return False, f"No se encontró información de pago pendiente para el usuario {chat_id_usuario}."
+
+    reclamado, ticket = pool.reclamar_de_chat(chat_id_usuario, TICKET_PAGO, operador_id)
+    if not reclamado:
+        return False, f"Otro operador ya está atendiendo el pago del usuario {chat_id_usuario}."
+
+    info_pago = pagos_pendientes[chat_id_usuario]
+    nombre_usuario = info_pago['nombre_usuario']
+
+    # Activate session
+    conversaciones_usuarios[chat_id_usuario] = {
+        'tipo_sesion': tipo_sesion_elegida,
+        'nombre_usuario': nombre_usuario,
+        'conversation_history': [],
+        'estado': 'activa',
+        'servicio': info_pago.get('servicio', 'coach_motivacional'),
+        'inicio': datetime.datetime.now()
+    }
 
-        await context.bot.send_message(
-            chat_id=chat_id_usuario,
-            text=mensaje_usuario,
-            reply_markup=ReplyKeyboardRemove()
-        )
+    # Remove from pending payments
+    del pagos_pendientes[chat_id_usuario]
+    registrar_evento(
+        eventos.PAGO_CONFIRMADO, chat_id_usuario,
+        servicio=conversaciones_usuarios[chat_id_usuario]['servicio'], tipo_sesion=tipo_sesion_elegida,
+        monto_usd=info_pago.get('precio_dolares', catalogo.actual().precios.get(tipo_sesion_elegida, 0)),
+        tasa=tenants.actual().tasa_bcv
+    )
+    if ticket:
+        pool.cerrar(ticket['id'])
+
+    # Send confirmation to user
+    session_name = format_session_name(tipo_sesion_elegida)
+    mensaje_usuario = (
+        f"¡Perfecto, {nombre_usuario}! Tu pago ha sido confirmado y activado. ✅\n\n"
+        f"Ahora puedes hacer todas las preguntas que necesites. Estoy aquí para ayudarte. 😊"
+    )
+
+    await context.bot.send_message(
+        chat_id=chat_id_usuario,
+        text=mensaje_usuario,
+        reply_markup=ReplyKeyboardRemove()
+    )
 
-        # Start timer for extended session
-        if tipo_sesion_elegida == TIPO_SESION_EXTENDIDA:
-            asyncio.create_task(iniciar_temporizador_extendida(context, chat_id_usuario))
+    # Start timer for extended session
+    if tipo_sesion_elegida == TIPO_SESION_EXTENDIDA:
+        asyncio.create_task(iniciar_temporizador_extendida(context, chat_id_usuario))
 
-        # Confirm to admin
-        await update.message.reply_text(
-            f"✅ Pago confirmado para {nombre_usuario} (ID: {chat_id_usuario}). "
-            f"Se activó la {session_name}."
+    logger.info("Payment confirmed for %s, %s activated.", chat_id_usuario, session_name)
+    return True, (
+        f"✅ Pago confirmado para {nombre_usuario} (ID: {chat_id_usuario}). "
+        f"Se activó la {session_name}."
+    )
+
+async def entregar_respuesta(context, operador_id, chat_id_usuario, respuesta, entrada=None):
+    """
+    Claim the question's ticket, send the answer and close it.
+    Returns False if the ticket was already claimed or answered by another operator.
+    """
+    ticket_id = entrada['ticket'] if entrada else None
+    if ticket_id is not None and not pool.reclamar(ticket_id, operador_id):
+        return False
+
+    try:
+        # Send response to user (long answers go out as several messages, in order)
+        await enviar_texto(context.bot, chat_id_usuario, respuesta)
+    except Exception:
+        if ticket_id is not None:
+            pool.liberar(ticket_id, operador_id)
+        raise
+
+    busqueda.indexar(chat_id_usuario, respuesta, busqueda.RESPUESTA)
+
+    # Remove from pending questions; only answers to a queued question have an answer time
+    if entrada:
+        preguntas_pendientes.quitar(entrada['id'])
+        sesion = conversaciones_usuarios.get(chat_id_usuario, {})
+        registrar_evento(
+            eventos.RESPUESTA, chat_id_usuario,
+            servicio=sesion.get('servicio'), tipo_sesion=sesion.get('tipo_sesion'),
+            valor=(datetime.datetime.now() - entrada['timestamp']).total_seconds()
         )
-        logger.info(f"Payment confirmed for {chat_id_usuario}, {session_name} activated.")
+    if ticket_id is not None:
+        pool.cerrar(ticket_id)
 
-    except ValueError:
-        await update.message.reply_text("El chat_id debe ser un número válido.")
-    except Exception as e:
-        logger.error(f"Error confirming payment: {e}")
-        await update.message.reply_text("Error al confirmar el pago. Por favor, intenta de nuevo.")
+    # Check if it's a standard session that should end after response
+    if chat_id_usuario in conversaciones_usuarios:
+        sesion = conversaciones_usuarios[chat_id_usuario]
+        if sesion.get('tipo_sesion') == TIPO_SESION_ESTANDAR and sesion.get('estado') == 'activa':
+            # End standard session after response
+            await finalizar_sesion_estandar(context, chat_id_usuario)
+            logger.info("Standard session ended for %s after operator response", chat_id_usuario)
+
+    return True
 
 async def responder_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin response command to send AI response to user."""
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
@@ -279,55 +416,50 @@ async def responder_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         chat_id_usuario = int(context.args[0])
-        respuesta = ' '.join(context.args[1:])
+        respuesta = utils.texto_tras_comando(update.message.text, argumentos=1)
 
-        # Send response to user
-        await context.bot.send_message(
-            chat_id=chat_id_usuario,
-            text=respuesta
-        )
+        # Answer the chat's most urgent pending question
+        entradas = preguntas_pendientes.de_chat(chat_id_usuario)
+        entrada = entradas[0] if entradas else None
 
-        # Check if it's a standard session that should end after response
-        if chat_id_usuario in conversaciones_usuarios:
-            sesion = conversaciones_usuarios[chat_id_usuario]
-            if sesion.get('tipo_sesion') == TIPO_SESION_ESTANDAR and sesion.get('estado') == 'activa':
-                # End standard session after response
-                await finalizar_sesion_estandar(context, chat_id_usuario)
-                logger.info(f"Standard session ended for {chat_id_usuario} after responder command")
+        if not await entregar_respuesta(context, update.message.chat.id, chat_id_usuario, respuesta, entrada):
+            await update.message.reply_text(
+                f"Otro operador ya está respondiendo al usuario {chat_id_usuario}."
+            )
+            return
 
         # Confirm to admin
         await update.message.reply_text(
             f"✅ Respuesta enviada al usuario {chat_id_usuario}"
         )
-        logger.info(f"Admin response sent to {chat_id_usuario}")
-
-        # Remove from pending questions if exists
-        if chat_id_usuario in preguntas_pendientes:
-            del preguntas_pendientes[chat_id_usuario]
+        evento(logger, 'respuesta_enviada', chat_id=chat_id_usuario, via='responder')
 
     except ValueError:
         await update.message.reply_text("El chat_id debe ser un número válido.")
     except Exception as e:
-        logger.error(f"Error sending admin response: {e}")
+        logger.error("Error sending admin response: %s", e)
         await update.message.reply_text("Error al enviar la respuesta. Por favor, intenta de nuevo.")
 
 async def responder_rapido_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle quick response command to last user."""
+    """Handle quick response command to the most urgent pending question."""
     if not update.message:
         return
         
     # Check admin permissions
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    operador_id = update.message.chat.id
+    if not pool.es_operador(operador_id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
-        logger.warning(f"Unauthorized /r command attempt from {update.message.chat.id}")
+        logger.warning("Unauthorized /r command attempt from %s", update.message.chat.id)
         return
 
-    logger.info(f"Admin using /r command. Last user: {utils.ultimo_usuario_pregunta}")
-    logger.info(f"Pending questions: {list(preguntas_pendientes.keys())}")
+    # Most urgent question assigned to this operator, otherwise the most urgent overall
+    entrada = preguntas_pendientes.mas_urgente(
+        lambda e: pool.tickets.get(e['ticket'], {}).get('operador') == operador_id
+    ) or preguntas_pendientes.mas_urgente()
 
-    if not utils.ultimo_usuario_pregunta:
+    if not entrada:
         await update.message.reply_text(
-            "No hay usuario reciente al cual responder. Usa /pendientes para ver preguntas pendientes."
+            "No hay preguntas pendientes a las cuales responder."
         )
         return
 
@@ -339,42 +471,28 @@ async def responder_rapido_handler(update: Update, context: ContextTypes.DEFAULT
         return
 
     try:
-        respuesta = ' '.join(context.args)
-        chat_id_usuario = utils.ultimo_usuario_pregunta
-
-        # Send response to user
-        await context.bot.send_message(
-            chat_id=chat_id_usuario,
-            text=respuesta
-        )
-
-        # Get user name for confirmation
-        nombre_usuario = "Usuario"
-        if chat_id_usuario in preguntas_pendientes:
-            nombre_usuario = preguntas_pendientes[chat_id_usuario]['nombre']
-            del preguntas_pendientes[chat_id_usuario]
+        respuesta = utils.texto_tras_comando(update.message.text)
+        chat_id_usuario = entrada['chat_id']
 
-        # Check if it's a standard session that should end after response
-        if chat_id_usuario in conversaciones_usuarios:
-            sesion = conversaciones_usuarios[chat_id_usuario]
-            if sesion.get('tipo_sesion') == TIPO_SESION_ESTANDAR and sesion.get('estado') == 'activa':
-                # End standard session after response
-                await finalizar_sesion_estandar(context, chat_id_usuario)
-                logger.info(f"Standard session ended for {chat_id_usuario} after admin response")
+        if not await entregar_respuesta(context, operador_id, chat_id_usuario, respuesta, entrada):
+            await update.message.reply_text(
+                f"Otro operador ya está respondiendo a {entrada['nombre']}. Usa /pendientes para ver las demás."
+            )
+            return
 
         # Confirm to admin
         await update.message.reply_text(
-            f"✅ Respuesta rápida enviada a {nombre_usuario} (ID: {chat_id_usuario})"
+            f"✅ Respuesta rápida enviada a {entrada['nombre']} (ID: {chat_id_usuario})"
         )
-        logger.info(f"Quick response sent to {chat_id_usuario}")
+        evento(logger, 'respuesta_enviada', chat_id=chat_id_usuario, via='r', pregunta=entrada['id'])
 
     except Exception as e:
-        logger.error(f"Error sending quick response: {e}")
+        logger.error("Error sending quick response: %s", e)
         await update.message.reply_text("Error al enviar la respuesta rápida.")
 
 async def pendientes_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show pending questions."""
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    """Show pending questions, most urgent first."""
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
@@ -382,49 +500,58 @@ async def pendientes_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("No hay preguntas pendientes.")
         return
 
-    mensaje = "📋 **Preguntas Pendientes:**\n\n"
-    for i, (chat_id, info) in enumerate(preguntas_pendientes.items(), 1):
+    ahora = datetime.datetime.now()
+    mensaje = "📋 **Preguntas Pendientes (más urgentes primero):**\n\n"
+    for i, info in enumerate(preguntas_pendientes.ordenadas(), 1):
         timestamp = info['timestamp'].strftime("%H:%M")
-        consulta_formateada = f'"{info["nombre"]}: {info["pregunta"]}"'
+        minutos_restantes = int((info['limite'] - ahora).total_seconds() // 60)
+        urgencia = f"⏳ {minutos_restantes} min" if minutos_restantes >= 0 else "🚨 vencida"
+        consulta_formateada = escapar_codigo(f'"{info["nombre"]}: {info["pregunta"]}"')
+        ticket = pool.tickets.get(info['ticket'])
+        asignada = ""
+        if ticket and ticket['operador'] != update.message.chat.id:
+            asignada = f" · operador `{ticket['operador']}`"
         mensaje += (
-            f"**{i}.** {info['nombre']} (ID: `{chat_id}`) - {timestamp}\n"
+            f"**{i}.** {escapar(info['nombre'])} (ID: `{info['chat_id']}`) - {timestamp} · {urgencia}{asignada}\n"
             f"💬 `{consulta_formateada}`\n"
             f"⚡ Responder: `/r{i} [respuesta]`\n\n"
         )
 
-    await update.message.reply_text(mensaje, parse_mode=ParseMode.MARKDOWN)
+    await enviar_texto(context.bot, update.message.chat.id, mensaje, ParseMode.MARKDOWN)
 
 async def ultima_pregunta_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show last question received."""
     if not update.message:
         return
         
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
-    if not utils.ultimo_usuario_pregunta:
+    ultimo_usuario = pool.ultimo_chat.get(update.message.chat.id)
+    if not ultimo_usuario:
         await update.message.reply_text("No hay ninguna pregunta reciente.")
         return
 
-    if utils.ultimo_usuario_pregunta in preguntas_pendientes:
-        info = preguntas_pendientes[utils.ultimo_usuario_pregunta]
+    entradas = preguntas_pendientes.de_chat(ultimo_usuario)
+    if entradas:
+        info = max(entradas, key=lambda e: e['timestamp'])
         timestamp = info['timestamp'].strftime("%H:%M")
-        consulta_formateada = f'"{info["nombre"]}: {info["pregunta"]}"'
+        consulta_formateada = escapar_codigo(f'"{info["nombre"]}: {info["pregunta"]}"')
         mensaje = (
             f"🔄 **Última Pregunta Recibida:**\n\n"
-            f"👤 **{info['nombre']}** (ID: `{utils.ultimo_usuario_pregunta}`) - {timestamp}\n\n"
+            f"👤 **{escapar(info['nombre'])}** (ID: `{ultimo_usuario}`) - {timestamp}\n\n"
             f"💬 **Consulta para ChatGPT:**\n"
             f"`{consulta_formateada}`\n\n"
-            f"⚡ **Responder:** `/r [tu_respuesta]`"
+            f"⚡ **Responder:** `/responder {ultimo_usuario} [tu_respuesta]`"
         )
-        await update.message.reply_text(mensaje, parse_mode=ParseMode.MARKDOWN)
+        await enviar_texto(context.bot, update.message.chat.id, mensaje, ParseMode.MARKDOWN)
     else:
-        await update.message.reply_text(f"Última pregunta fue del usuario ID: {utils.ultimo_usuario_pregunta}")
+        await update.message.reply_text(f"Última pregunta fue del usuario ID: {ultimo_usuario}")
 
 async def responder_numerado_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle numbered response commands /r1, /r2, etc."""
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    """Handle numbered response commands /r1, /r2, etc. (numbers follow /pendientes urgency order)."""
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
@@ -440,58 +567,244 @@ async def responder_numerado_handler(update: Update, context: ContextTypes.DEFAU
         await update.message.reply_text(f"Uso: {command} [tu_respuesta_aquí]")
         return
 
-    # Get the nth question
-    preguntas_lista = list(preguntas_pendientes.items())
+    # Get the nth most urgent question
+    preguntas_lista = preguntas_pendientes.ordenadas()
     if numero > len(preguntas_lista):
         await update.message.reply_text(f"No existe la pregunta número {numero}.")
         return
 
-    chat_id_usuario, info = preguntas_lista[numero - 1]
-    respuesta = ' '.join(context.args)
+    info = preguntas_lista[numero - 1]
+    chat_id_usuario = info['chat_id']
+    respuesta = utils.texto_tras_comando(update.message.text)
 
     try:
-        # Send response to user
-        await context.bot.send_message(
-            chat_id=chat_id_usuario,
-            text=respuesta
-        )
-
-        # Check if it's a standard session that should end after response
-        if chat_id_usuario in conversaciones_usuarios:
-            sesion = conversaciones_usuarios[chat_id_usuario]
-            if sesion.get('tipo_sesion') == TIPO_SESION_ESTANDAR and sesion.get('estado') == 'activa':
-                # End standard session after response
-                await finalizar_sesion_estandar(context, chat_id_usuario)
-                logger.info(f"Standard session ended for {chat_id_usuario} after numbered response")
+        if not await entregar_respuesta(context, update.message.chat.id, chat_id_usuario, respuesta, info):
+            await update.message.reply_text(
+                f"Otro operador ya está respondiendo la pregunta #{numero}."
+            )
+            return
 
         # Confirm to admin
         await update.message.reply_text(
             f"✅ Respuesta #{numero} enviada a {info['nombre']} (ID: {chat_id_usuario})"
         )
-        logger.info(f"Numbered response #{numero} sent to {chat_id_usuario}")
-
-        # Remove from pending questions
-        del preguntas_pendientes[chat_id_usuario]
+        evento(logger, 'respuesta_enviada', chat_id=chat_id_usuario, via='rN', numero=numero)
 
     except Exception as e:
-        logger.error(f"Error sending numbered response: {e}")
+        logger.error("Error sending numbered response: %s", e)
         await update.message.reply_text(f"Error al enviar la respuesta #{numero}.")
 
+async def respuesta_nativa_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route an operator's native reply to a notification to the user behind it."""
+    if not update.message or not update.message.reply_to_message:
+        return
+
+    operador_id = update.message.chat.id
+    if not pool.es_operador(operador_id):
+        return
+
+    destino = utils.notificaciones_admin.buscar(operador_id, update.message.reply_to_message.message_id)
+    if destino is None:
+        await update.message.reply_text(
+            "No encuentro la pregunta de ese mensaje. Usa /pendientes o /responder [chat_id] [respuesta]."
+        )
+        return
+
+    chat_id_usuario, ticket_id = destino
+    respuesta = update.message.text
+    entrada = next(
+        (e for e in preguntas_pendientes.de_chat(chat_id_usuario) if e['ticket'] == ticket_id), None
+    )
+
+    try:
+        if entrada is not None:
+            if not await entregar_respuesta(context, operador_id, chat_id_usuario, respuesta, entrada):
+                await update.message.reply_text(
+                    f"Otro operador ya está respondiendo a {entrada['nombre']}."
+                )
+                return
+        else:
+            ticket = pool.tickets.get(ticket_id)
+            if ticket is None or ticket['tipo'] == TICKET_PREGUNTA:
+                await update.message.reply_text(
+                    f"Esa pregunta ya fue respondida. Para escribirle de nuevo usa "
+                    f"/responder {chat_id_usuario} [respuesta]."
+                )
+                return
+            # Replies to payment notifications go straight to the user
+            await enviar_texto(context.bot, chat_id_usuario, respuesta)
+
+        await update.message.reply_text(f"✅ Respuesta enviada al usuario {chat_id_usuario}")
+        evento(logger, 'respuesta_enviada', chat_id=chat_id_usuario, via='reply', ticket=ticket_id)
+
+    except Exception as e:
+        logger.error("Error sending reply-to response: %s", e)
+        await update.message.reply_text("Error al enviar la respuesta. Por favor, intenta de nuevo.")
+
+async def _marcar_notificacion(query, resultado):
+    """Edit an operator notification in place: drop its buttons and append the outcome."""
+    mensaje = query.message
+    try:
+        if not isinstance(mensaje, Message):
+            return
+        if mensaje.caption is not None:
+            await query.edit_message_caption(
+                caption=f"{mensaje.caption_markdown}\n\n{escapar(resultado)}",
+                parse_mode=ParseMode.MARKDOWN, reply_markup=None
+            )
+        else:
+            await query.edit_message_text(
+                text=f"{mensaje.text_markdown}\n\n{escapar(resultado)}",
+                parse_mode=ParseMode.MARKDOWN, reply_markup=None
+            )
+    except (BadRequest, ValueError) as e:
+        # Too long once annotated, or already edited by a previous tap: at least remove the buttons
+        logger.debug("Could not annotate notification %s: %s", mensaje.message_id, e)
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except BadRequest:
+            pass
+
+async def _pedir_respuesta(context, operador_id, ticket_id):
+    """Send the operator a reply prompt for a question, routed like any reply to a notification."""
+    entrada = next((e for e in preguntas_pendientes.ordenadas() if e['ticket'] == ticket_id), None)
+    if entrada is None:
+        return False
+    consulta_formateada = escapar_codigo(f'"{entrada["nombre"]}: {entrada["pregunta"]}"')
+    borrador = (
+        f"✍️ **Respuesta para {escapar(entrada['nombre'])}** (ID: `{entrada['chat_id']}`)\n\n"
+        f"💬 **Consulta para ChatGPT:**\n"
+        f"`{consulta_formateada}`\n\n"
+        f"Responde a este mensaje con el texto que recibirá el usuario."
+    )
+    enviados = await enviar_texto(
+        context.bot, operador_id, borrador, ParseMode.MARKDOWN,
+        reply_markup=ForceReply(selective=True, input_field_placeholder=f"Respuesta para {entrada['nombre']}"[:64])
+    )
+    for mensaje in enviados:
+        utils.notificaciones_admin.registrar(operador_id, mensaje.message_id, entrada['chat_id'], ticket_id)
+    return True
+
+async def _rechazar_pago(context, operador_id, ticket):
+    """Reject a payment receipt; the user keeps the pending payment and can send another one."""
+    if not pool.reclamar(ticket['id'], operador_id):
+        return False
+    pool.cerrar(ticket['id'])
+    await context.bot.send_message(
+        chat_id=ticket['chat_id'],
+        text=(
+            "No pudimos verificar tu pago. 😔\n\n"
+            "Revisa el monto y los datos de la transferencia y envía de nuevo el comprobante o la referencia."
+        )
+    )
+    return True
+
+def _marcar_spam(operador_id, ticket):
+    """Mute the chat behind a ticket and discard what it had pending."""
+    if not pool.reclamar(ticket['id'], operador_id):
+        return False
+    chat_id = ticket['chat_id']
+    limitador.silenciar(chat_id)
+    for entrada in preguntas_pendientes.de_chat(chat_id):
+        preguntas_pendientes.quitar(entrada['id'])
+    pagos_pendientes.pop(chat_id, None)
+    # Every open ticket of the chat, so none is reassigned or flagged at risk afterwards
+    for abierto in [t for t in pool.tickets.values() if t['chat_id'] == chat_id]:
+        pool.cerrar(abierto['id'])
+    return True
+
+async def accion_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Apply an inline button of an operator notification: confirm, reject, answer or mark spam."""
+    query = update.callback_query
+    operador_id = query.from_user.id
+    if not pool.es_operador(operador_id):
+        await query.answer("No tienes permisos para usar este comando.", show_alert=True)
+        return
+
+    resuelto = acciones.registro.resolver(query.data)
+    if resuelto is None:
+        evento(logger, 'accion_invalida', nivel=logging.WARNING, operador=operador_id)
+        await query.answer("Este botón ya no es válido. Usa /pendientes o los comandos.", show_alert=True)
+        return
+    accion, ticket_id, chat_id, tipo = resuelto
+
+    # Double taps and taps on other copies of the notification just report the outcome
+    previo = acciones.registro.resultado(ticket_id)
+    ticket = pool.tickets.get(ticket_id)
+    if ticket is not None and (ticket['chat_id'] != chat_id or ticket['tipo'] != tipo):
+        evento(logger, 'accion_invalida', nivel=logging.WARNING, operador=operador_id, ticket=ticket_id)
+        await query.answer("Este botón no corresponde a este ticket.", show_alert=True)
+        return
+    if previo is not None or ticket is None:
+        await query.answer(previo or "Este ticket ya fue atendido.")
+        await _marcar_notificacion(query, previo or "Ticket cerrado.")
+        return
+
+    if not acciones.registro.iniciar(ticket_id):
+        await query.answer("Esta acción ya se está procesando.")
+        return
+
+    resultado = None
+    try:
+        nombre_operador = query.from_user.first_name or str(operador_id)
+        hora = datetime.datetime.now().strftime('%H:%M')
+        if accion == acciones.RESPONDER:
+            if await _pedir_respuesta(context, operador_id, ticket_id):
+                await query.answer("Responde al mensaje que te acabo de enviar.")
+            else:
+                await query.answer("Esa pregunta ya fue respondida.")
+            return
+
+        if accion == acciones.CONFIRMAR:
+            info_pago = pagos_pendientes.get(ticket['chat_id'])
+            if info_pago is None:
+                ok, detalle = False, f"No se encontró información de pago pendiente para el usuario {ticket['chat_id']}."
+            else:
+                ok, detalle = await activar_sesion(
+                    context, operador_id, ticket['chat_id'], info_pago['tipo_sesion_elegida']
+                )
+            if ok:
+                resultado = f"✅ Pago confirmado por {nombre_operador} · {hora}"
+        elif accion == acciones.RECHAZAR:
+            ok = await _rechazar_pago(context, operador_id, ticket)
+            detalle = "Otro operador ya está atendiendo este pago."
+            if ok:
+                resultado = f"❌ Pago rechazado por {nombre_operador} · {hora}"
+        else:
+            ok = _marcar_spam(operador_id, ticket)
+            detalle = "Otro operador ya está atendiendo este ticket."
+            if ok:
+                resultado = f"🚫 Marcado como spam por {nombre_operador} · {hora}"
+
+        if resultado is None:
+            await query.answer(detalle, show_alert=True)
+            return
+        await query.answer(resultado)
+        await _marcar_notificacion(query, resultado)
+        evento(logger, 'accion_operador', accion=accion, ticket=ticket_id, operador=operador_id, chat_id=ticket['chat_id'])
+
+    except Exception as e:
+        logger.error("Error applying action %s on ticket %s: %s", accion, ticket_id, e)
+        await query.answer("Error al aplicar la acción. Por favor, intenta de nuevo.", show_alert=True)
+    finally:
+        acciones.registro.terminar(ticket_id, resultado)
+
 async def respuesta_rapida_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle quick response template command."""
     if not update.message:
         return
         
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    if not pool.es_operador(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
     await update.message.reply_text(
         "📝 **Comandos de Respuesta Rápida:**\n\n"
-        "⚡ `/r [respuesta]` - Responder al último usuario\n"
+        "↩️ Responder (reply) a una notificación - Contestar esa pregunta exacta\n"
+        "⚡ `/r [respuesta]` - Responder la pregunta más urgente\n"
         "📋 `/pendientes` - Ver todas las preguntas pendientes\n"
         "🔄 `/ultima` - Ver la última pregunta recibida\n"
-        "🔢 `/r1`, `/r2`, etc. - Responder pregunta específica por número\n\n"
+        "🔢 `/r1`, `/r2`, etc. - Responder pregunta específica por número (orden de urgencia)\n\n"
         "💡 **Ejemplo:**\n"
         "`/r Gracias por tu pregunta, aquí está mi respuesta...`",
         parse_mode=ParseMode.MARKDOWN
@@ -502,7 +815,7 @@ async def admin_status_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     if not update.message:
         return
         
-    if update.message.chat.id != YOUR_TELEGRAM_ID:
+    if not pool.es_admin(update.message.chat.id):
         await update.message.reply_text("No tienes permisos para usar este comando.")
         return
 
@@ -510,24 +823,208 @@ async def admin_status_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     num_pendientes = len(preguntas_pendientes)
     num_sesiones_activas = len([s for s in conversaciones_usuarios.values() if s.get('estado') == 'activa'])
     num_pagos_pendientes = len(pagos_pendientes)
+    logs_en_cola, logs_descartados, _ = logs.estadisticas()
+    loop = vigia.estado()
+    carriles = "".join(
+        f"• {m['nombre']} (HTTP/{m['http']}): {m['en_vuelo']}/{m['capacidad']} en vuelo, "
+        f"pico {m['pico_en_vuelo']}, esperas {m['esperas']} "
+        f"(media {m['espera_media_ms']:.1f} ms, máx {m['espera_max_ms']:.0f} ms), "
+        f"timeouts {m['timeouts_pool']}\n"
+        for m in transporte.metricas()
+    )
     
     mensaje = (
         f"🤖 **Estado del Sistema Apoyo Integral**\n\n"
         f"📊 **Estadísticas Actuales:**\n"
         f"• Preguntas pendientes: {num_pendientes}\n"
         f"• Sesiones activas: {num_sesiones_activas}\n"
-        f"• Pagos pendientes: {num_pagos_pendientes}\n\n"
-        f"👤 **Último usuario con pregunta:** {utils.ultimo_usuario_pregunta or 'Ninguno'}\n\n"
+        f"• Pagos pendientes: {num_pagos_pendientes}\n"
+        f"• Operadores: {len(pool.operadores)} · Tickets abiertos: {len(pool.tickets)}\n"
+        f"• Catálogo: v{catalogo.actual().version} ({catalogo.gestor.recargas} recargas)\n"
+        f"• Reintentos de Telegram descartados: {ventana_updates.duplicados}\n"
+        f"• Logs en cola: {logs_en_cola} · descartados: {logs_descartados}\n"
+        f"• Event loop: lag {loop['lag_ms']:.0f} ms (máx {loop['lag_max_ms']:.0f} ms) · "
+        f"{loop['handlers_en_curso']} updates en curso · {loop['handlers_lentos']} lentos · {loop['bloqueos']} bloqueos\n"
+        f"• Bitácora de ingreso: {'OK' if loop['bitacora_sana'] else '⚠️ sin poder escribir, rechazando updates'}\n"
+        f"• Antiflood: {len(limitador)} chats · {limitador.rechazados} mensajes frenados · {limitador.silenciados} silenciados\n\n"
+        f"🌐 **Conexiones HTTP:**\n"
+        f"{carriles}\n"
+        f"👤 **Último usuario con pregunta:** {tenants.actual().ultimo_usuario_pregunta or 'Ninguno'}\n\n"
         f"🔧 **Comandos Disponibles:**\n"
-        f"• `/r [respuesta]` - Responder al último\n"
+        f"• `/r [respuesta]` - Responder la más urgente\n"
         f"• `/pendientes` - Ver todas las preguntas\n"
         f"• `/ultima` - Ver última pregunta\n"
         f"• `/confirmar_pago [user_id] [tipo_sesion]`\n"
+        f"• `/operadores` - Ver carga de operadores\n"
+        f"• `/stats [días]` - Ingresos, embudo y tiempos de respuesta\n"
+        f"• `/recargar` - Recargar el catálogo de servicios y precios\n"
+        f"• `/buscar [términos] [#página]` - Buscar en preguntas y respuestas\n"
+        f"• `/perfil [30s]` - Perfil de CPU del event loop\n"
+        f"• `/memoria [30s]` - Memoria, objetos en memoria y tareas\n"
         f"• `/rapida` - Ver ayuda de comandos\n\n"
         f"✅ **Sistema funcionando correctamente**"
     )
     
-    await update.message.reply_text(mensaje, parse_mode=ParseMode.MARKDOWN)
+    await enviar_texto(context.bot, update.message.chat.id, mensaje, ParseMode.MARKDOWN)
+
+async def operadores_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show operator pool load."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    mensaje = "👥 **Operadores:**\n\n"
+    for operador_id, rol, carga in pool.resumen():
+        mensaje += f"• `{operador_id}` ({rol}) - {carga} tickets abiertos\n"
+
+    await enviar_texto(context.bot, update.message.chat.id, mensaje, ParseMode.MARKDOWN)
+
+async def recargar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reload the service catalog from disk without restarting."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    ok, detalle = await asyncio.to_thread(catalogo.gestor.recargar)
+    if ok:
+        cat = catalogo.actual()
+        await update.message.reply_text(
+            f"✅ Catálogo {detalle} activo: {len(cat.nombres_servicio)} servicios, {len(cat.precios)} tipos de sesión."
+        )
+    else:
+        await update.message.reply_text(f"❌ Catálogo rechazado, se mantiene el actual.\n{detalle}")
+
+def _resultados_busqueda(consulta, pagina):
+    """Run a search and load the texts of one page of hits (blocking: call from a thread)."""
+    inicio = time.perf_counter()
+    total, resultados = busqueda.indice.buscar(consulta, pagina)
+    documentos = [busqueda.indice.documento(doc_id) for _, doc_id in resultados]
+    return total, documentos, (time.perf_counter() - inicio) * 1000
+
+async def buscar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Full-text search over past questions and answers."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    consulta = utils.texto_tras_comando(update.message.text)
+    pagina = 1
+    coincidencia = re.search(r'\s*#(\d+)$', consulta)
+    if coincidencia:
+        pagina = max(1, int(coincidencia.group(1)))
+        consulta = consulta[:coincidencia.start()]
+    if not busqueda.tokenizar(consulta):
+        await update.message.reply_text("Uso correcto: /buscar [términos] [#página]\nEjemplo: /buscar manejo del aula #2")
+        return
+
+    total, documentos, milisegundos = await asyncio.to_thread(_resultados_busqueda, consulta, pagina)
+    if not total:
+        await update.message.reply_text(f"🔎 Sin resultados para «{consulta}».")
+        return
+
+    paginas = -(-total // busqueda.RESULTADOS_POR_PAGINA)
+    if not documentos:
+        await update.message.reply_text(f"🔎 «{consulta}» tiene {paginas} páginas de resultados.")
+        return
+    lineas = [f"🔎 {total} resultados para «{consulta}» · página {pagina}/{paginas} · {milisegundos:.0f} ms\n"]
+    primero = (pagina - 1) * busqueda.RESULTADOS_POR_PAGINA + 1
+    for numero, (chat_id, fecha, tipo, texto) in enumerate(documentos, start=primero):
+        icono = "❓" if tipo == busqueda.PREGUNTA else "💬"
+        cuando = datetime.datetime.fromtimestamp(fecha).strftime('%d/%m/%Y %H:%M')
+        extracto = texto if len(texto) <= 160 else texto[:157] + "..."
+        lineas.append(f"{numero}. {icono} {cuando} · chat {chat_id}\n{extracto}\n")
+    if pagina < paginas:
+        lineas.append(f"Siguiente página: /buscar {consulta} #{pagina + 1}")
+    # Plain text: user messages may contain Markdown characters
+    await enviar_texto(context.bot, update.message.chat.id, "\n".join(lineas))
+
+async def _diagnosticar(context, chat_id, nombre_archivo, informe):
+    """Await a diagnosis started by an admin command and send its report."""
+    try:
+        texto = await informe
+        if texto is None:
+            await context.bot.send_message(chat_id=chat_id, text="Ya hay un diagnóstico en curso. Espera a que termine.")
+            return
+        await diagnostico.enviar_informe(context.bot, chat_id, nombre_archivo, texto)
+    except Exception as e:
+        logger.error("Error running diagnosis %s: %s", nombre_archivo, e)
+        await context.bot.send_message(chat_id=chat_id, text="Error al generar el diagnóstico.")
+
+async def perfil_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sample the event loop for a window and report where CPU time goes."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    segundos = diagnostico.parsear_duracion(" ".join(context.args), 30)
+    if segundos is None:
+        await update.message.reply_text("Uso: /perfil [duración]\nEjemplo: /perfil 30s")
+        return
+    if diagnostico.ocupado():
+        await update.message.reply_text("Ya hay un diagnóstico en curso. Espera a que termine.")
+        return
+
+    await update.message.reply_text(f"⏱️ Perfilando el event loop durante {segundos} s...")
+    # Runs in the background: the profile itself must not keep this update open
+    asyncio.create_task(_diagnosticar(context, update.message.chat.id, "perfil.txt", diagnostico.perfilar(segundos)))
+
+async def memoria_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Trace allocations for a window and report memory use and object counts."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    segundos = diagnostico.parsear_duracion(" ".join(context.args), 30)
+    if segundos is None:
+        await update.message.reply_text("Uso: /memoria [duración]\nEjemplo: /memoria 1m")
+        return
+    if diagnostico.ocupado():
+        await update.message.reply_text("Ya hay un diagnóstico en curso. Espera a que termine.")
+        return
+
+    await update.message.reply_text(f"🧠 Trazando asignaciones de memoria durante {segundos} s...")
+    asyncio.create_task(_diagnosticar(
+        context, update.message.chat.id, "memoria.txt", diagnostico.memoria(segundos, tenants.actual())
+    ))
+
+async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show revenue, conversion funnel and answer-time report from the event log."""
+    if not update.message:
+        return
+
+    if not pool.es_admin(update.message.chat.id):
+        await update.message.reply_text("No tienes permisos para usar este comando.")
+        return
+
+    try:
+        dias = int(context.args[0]) if context.args else 7
+    except ValueError:
+        await update.message.reply_text("Uso: /stats [días]")
+        return
+
+    try:
+        import analitica
+        # Heavy NumPy work runs off the event loop
+        reporte = await asyncio.to_thread(analitica.generar_reporte, max(1, min(dias, 90)))
+        await enviar_texto(context.bot, update.message.chat.id, reporte, ParseMode.MARKDOWN)
+    except Exception as e:
+        logger.error("Error generating stats report: %s", e)
+        await update.message.reply_text("Error al generar las estadísticas.")
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all text messages from users."""
@@ -537,9 +1034,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id_usuario = update.message.chat.id
     texto_usuario = update.message.text
     nombre_usuario = update.effective_user.first_name or "Usuario"
+    # One catalog snapshot for the whole message, even if it is reloaded meanwhile
+    cat = catalogo.actual()
 
-    # Skip admin messages
-    if chat_id_usuario == YOUR_TELEGRAM_ID:
+    # Skip operator messages
+    if pool.es_operador(chat_id_usuario):
         return
 
     # Check if this is a returning user and handle appropriately
@@ -554,12 +1053,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Handle service selection
-    if texto_usuario in MENU_SERVICIOS_A_TIPO:
-        servicio_elegido = MENU_SERVICIOS_A_TIPO[texto_usuario]
-        
+    servicio_elegido = cat.servicios_por_etiqueta.get(texto_usuario)
+    if servicio_elegido:
         # Show service description
-        resumen = RESUMEN_SERVICIOS.get(servicio_elegido, "Servicio de apoyo integral disponible.")
-        keyboard = generate_session_keyboard()
+        resumen = cat.resumenes.get(servicio_elegido, "Servicio de apoyo integral disponible.")
+        keyboard = generate_session_keyboard(cat)
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
         # Store selected service in pending payment info if exists
@@ -571,13 +1069,14 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"¿Qué tipo de sesión te gustaría solicitar?",
             reply_markup=reply_markup
         )
-        logger.info(f"User {nombre_usuario} selected service: {servicio_elegido}")
+        evento(logger, 'servicio_elegido', chat_id=chat_id_usuario, servicio=servicio_elegido)
+        registrar_evento(eventos.SERVICIO_ELEGIDO, chat_id_usuario, servicio=servicio_elegido)
         return
 
     # Handle session type selection
-    if texto_usuario in MENU_OPCIONES_A_TIPO:
-        tipo_sesion_elegida = MENU_OPCIONES_A_TIPO[texto_usuario]
-        precio_dolares = PRECIO_SESION[tipo_sesion_elegida]
+    tipo_sesion_elegida = cat.sesiones_por_etiqueta.get(texto_usuario)
+    if tipo_sesion_elegida:
+        precio_dolares = cat.precios[tipo_sesion_elegida]
         
         # Store service info before showing payment
         if chat_id_usuario not in pagos_pendientes:
@@ -591,12 +1090,12 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'precio_dolares': precio_dolares
         })
         
-        await mostrar_informacion_pago(update, context, tipo_sesion_elegida, precio_dolares)
+        await mostrar_informacion_pago(update, context, tipo_sesion_elegida, precio_dolares, cat)
         return
 
     # Handle "Volver al Menú Principal"
-    if texto_usuario == "🏠 Volver al Menú Principal":
-        keyboard = generate_service_keyboard()
+    if texto_usuario == VOLVER_MENU:
+        keyboard = generate_service_keyboard(cat)
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
         await update.message.reply_text(
@@ -614,6 +1113,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'timestamp': datetime.datetime.now(),
                 'user_message': texto_usuario
             })
+            busqueda.indexar(chat_id_usuario, texto_usuario)
             
             # Notify admin
             await notify_admin_user_question(context, chat_id_usuario, nombre_usuario, texto_usuario)
@@ -622,11 +1122,15 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(
                 "He recibido tu pregunta. Te responderé pronto. 😊"
             )
-            logger.info(f"Question received from active session user {chat_id_usuario}")
+            evento(logger, 'pregunta_recibida', chat_id=chat_id_usuario)
+            registrar_evento(
+                eventos.PREGUNTA, chat_id_usuario,
+                servicio=sesion.get('servicio'), tipo_sesion=sesion.get('tipo_sesion')
+            )
             return
 
     # Default response for unrecognized messages
-    keyboard = generate_service_keyboard()
+    keyboard = generate_service_keyboard(cat)
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
     await update.message.reply_text(
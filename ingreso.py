@@ -0,0 +1,45 @@
+import hmac
+import logging
+
+try:
+    import orjson
+    cargar_json = orjson.loads
+except ImportError:
+    import json
+    cargar_json = json.loads
+
+logger = logging.getLogger(__name__)
+
+CABECERA_SECRETO = "X-Telegram-Bot-Api-Secret-Token"
+
+# Update kinds with a registered handler, and for each one the payload keys a handler
+# actually reads (None = any). Keep in sync with the handlers registered in main.py.
+UPDATES_ATENDIDOS = {
+    "message": ("text", "photo"),
+    "callback_query": ("data",),
+}
+
+def autorizado(secreto_recibido, secreto):
+    """Constant-time check of the webhook secret header."""
+    if not secreto:
+        return True
+    return hmac.compare_digest((secreto_recibido or "").encode(), secreto.encode())
+
+def clasificar(datos):
+    """Return the update kind if some handler consumes it, else None."""
+    for clave, contenido in datos.items():
+        if clave == "update_id":
+            continue
+        if clave not in UPDATES_ATENDIDOS:
+            return None
+        campos = UPDATES_ATENDIDOS[clave]
+        if campos is None:
+            return clave
+        if isinstance(contenido, dict) and any(campo in contenido for campo in campos):
+            return clave
+        return None
+    return None
+
+def tipos_permitidos():
+    """allowed_updates list for setWebhook, so Telegram does not even send the rest."""
+    return list(UPDATES_ATENDIDOS)
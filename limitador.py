@@ -0,0 +1,89 @@
+import logging
+import time
+
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+PERMITIDO = "permitido"
+EXCESO = "exceso"
+SILENCIADO = "silenciado"
+RECIEN_SILENCIADO = "recien_silenciado"
+
+# Slots of the per-chat state list
+_TOKENS, _ULTIMO, _INFRACCIONES, _ULTIMA_INFRACCION, _SILENCIO_HASTA = range(5)
+
+class LimitadorChats:
+    """
+    Per-chat token buckets with temporary mutes for repeat offenders.
+
+    Each chat costs one five-slot list; a check is a handful of float operations.
+    A chat that exceeds its bucket max_infracciones times without calming down for
+    a full refill period is muted for silencio_segundos.
+    """
+
+    def __init__(self, rafaga, segundos_por_mensaje, max_infracciones, silencio_segundos, max_chats=200000):
+        self.rafaga = float(rafaga)
+        self.recarga = 1.0 / segundos_por_mensaje if segundos_por_mensaje > 0 else float('inf')
+        self.max_infracciones = max_infracciones
+        self.silencio_segundos = silencio_segundos
+        self.max_chats = max_chats
+        self.olvido = self.rafaga / self.recarga if self.recarga != float('inf') else 0.0
+        self._chats = {}
+        self.rechazados = 0
+        self.silenciados = 0
+
+    def __len__(self):
+        return len(self._chats)
+
+    def permitir(self, chat_id, ahora=None):
+        """Spend one token for chat_id. Returns PERMITIDO, EXCESO, SILENCIADO or RECIEN_SILENCIADO."""
+        ahora = ahora if ahora is not None else time.monotonic()
+        estado = self._chats.get(chat_id)
+        if estado is None:
+            if len(self._chats) >= self.max_chats:
+                self._podar(ahora)
+            self._chats[chat_id] = [self.rafaga - 1.0, ahora, 0, 0.0, 0.0]
+            return PERMITIDO
+
+        if estado[_SILENCIO_HASTA] > ahora:
+            self.rechazados += 1
+            return SILENCIADO
+
+        estado[_TOKENS] = min(self.rafaga, estado[_TOKENS] + (ahora - estado[_ULTIMO]) * self.recarga)
+        estado[_ULTIMO] = ahora
+        if estado[_TOKENS] >= 1.0:
+            estado[_TOKENS] -= 1.0
+            return PERMITIDO
+
+        self.rechazados += 1
+        if ahora - estado[_ULTIMA_INFRACCION] > self.olvido:
+            estado[_INFRACCIONES] = 0
+        estado[_INFRACCIONES] += 1
+        estado[_ULTIMA_INFRACCION] = ahora
+        if estado[_INFRACCIONES] >= self.max_infracciones:
+            estado[_SILENCIO_HASTA] = ahora + self.silencio_segundos
+            estado[_INFRACCIONES] = 0
+            self.silenciados += 1
+            logger.warning("Chat %s muted for %s s after repeated flooding.", chat_id, self.silencio_segundos)
+            return RECIEN_SILENCIADO
+        return EXCESO
+
+    def silenciar(self, chat_id, segundos=None, ahora=None):
+        """Mute a chat explicitly (e.g. marked as spam by an operator)."""
+        ahora = ahora if ahora is not None else time.monotonic()
+        estado = self._chats.setdefault(chat_id, [self.rafaga, ahora, 0, 0.0, 0.0])
+        estado[_SILENCIO_HASTA] = ahora + (segundos if segundos is not None else self.silencio_segundos)
+        self.silenciados += 1
+
+    def _podar(self, ahora):
+        """Forget chats whose bucket would already be full again and that are not muted."""
+        inactivos = [
+            chat_id for chat_id, estado in self._chats.items()
+            if estado[_SILENCIO_HASTA] <= ahora and ahora - estado[_ULTIMO] >= self.olvido
+        ]
+        for chat_id in inactivos:
+            del self._chats[chat_id]
+        logger.info("Rate limiter pruned %s idle chats (%s remain).", len(inactivos), len(self._chats))
+
+limitador = Proxy('limitador')  # Rate limiter of the current tenant
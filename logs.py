@@ -0,0 +1,115 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_NIVEL, LOG_MUESTREO, LOG_COLA_MAX
+
+class ColaLogHandler(QueueHandler):
+    """
+    QueueHandler that never blocks and never formats on the caller's thread.
+
+    The stock QueueHandler.prepare() renders the message eagerly; here the record is
+    enqueued as-is and the background listener does all formatting and I/O.
+    When the queue is full the record is dropped and counted instead of waiting.
+    """
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+class FiltroMuestreo(logging.Filter):
+    """Keep only a fraction of high-volume events, by event name. Warnings and errors always pass."""
+
+    def __init__(self, tasas):
+        super().__init__()
+        self.tasas = dict(tasas)
+        self.omitidos = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        tasa = self.tasas.get(getattr(record, 'evento', None))
+        if tasa is None or tasa >= 1.0 or random.random() < tasa:
+            return True
+        self.omitidos[record.evento] = self.omitidos.get(record.evento, 0) + 1
+        return False
+
+class FormatoEstructurado(logging.Formatter):
+    """Render records as 'time level logger message key=value ...' in the listener thread."""
+
+    def format(self, record):
+        linea = super().format(record)
+        campos = getattr(record, 'campos', None)
+        if campos:
+            linea += ' ' + ' '.join(f"{clave}={valor!r}" if isinstance(valor, str) else f"{clave}={valor}"
+                                    for clave, valor in campos.items())
+        return linea
+
+def evento(logger, nombre, nivel=logging.INFO, **campos):
+    """
+    Log a structured event. Costs one level check when disabled and one small dict
+    when enabled: formatting happens later, off the event loop.
+    Pass only scalars as campos, never whole state objects.
+    """
+    if logger.isEnabledFor(nivel):
+        logger.log(nivel, nombre, extra={'evento': nombre, 'campos': campos})
+
+def _parsear_muestreo(texto):
+    """Parse 'evento=tasa,evento=tasa' into a dict."""
+    tasas = {}
+    for parte in (texto or '').split(','):
+        nombre, _, tasa = parte.strip().partition('=')
+        if not nombre:
+            continue
+        try:
+            tasas[nombre] = max(0.0, min(1.0, float(tasa)))
+        except ValueError:
+            logging.getLogger(__name__).error("Invalid sampling rate '%s' for event %s.", tasa, nombre)
+    return tasas
+
+_listener = None
+cola_handler = None
+filtro_muestreo = None
+
+def configurar_logging():
+    """Route all logging through a bounded queue drained by a background thread."""
+    global _listener, cola_handler, filtro_muestreo
+    if _listener is not None:
+        return
+
+    formato = FormatoEstructurado("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(formato)
+
+    cola = queue.Queue(maxsize=LOG_COLA_MAX)
+    filtro_muestreo = FiltroMuestreo(_parsear_muestreo(LOG_MUESTREO))
+    cola_handler = ColaLogHandler(cola)
+    cola_handler.addFilter(filtro_muestreo)
+
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(cola_handler)
+    raiz.setLevel(LOG_NIVEL)
+
+    _listener = QueueListener(cola, salida, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def estadisticas():
+    """Return (queued, dropped, sampled-out per event) for status reports."""
+    if cola_handler is None:
+        return 0, 0, {}
+    return cola_handler.queue.qsize(), cola_handler.descartados, dict(filtro_muestreo.omitidos)
@@ -2,16 +2,24 @@
 import os
 import asyncio
 import logging
+import threading
 
 # Silenciar logs ruidosos
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 
-from flask import Flask, request, abort
+from flask import Flask, request, abort, jsonify
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from config import TELEGRAM_TOKEN
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler, filters
+from telegram.request import HTTPXRequest
+from duplicados import extraer_update_id
+from ingreso import CABECERA_SECRETO, autorizado, cargar_json, clasificar, tipos_permitidos
+from transporte import transporte
+from logs import configurar_logging, evento
+import tenants
+from vigia import vigia
 from handlers import (
+    limitar_entrada_handler,
     start_handler,
     message_handler,
     photo_handler,
@@ -22,43 +30,79 @@ from handlers import (
     ultima_pregunta_handler,
     responder_numerado_handler,
     respuesta_rapida_handler,
-    admin_status_handler
+    admin_status_handler,
+    operadores_handler,
+    stats_handler,
+    recargar_handler,
+    buscar_handler,
+    perfil_handler,
+    memoria_handler,
+    respuesta_nativa_handler,
+    accion_handler
 )
-from telegram.request import HTTPXRequest
 
-# Logging propio
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Logging propio: el event loop solo encola, un hilo aparte escribe en stdout
+configurar_logging()
 logger = logging.getLogger(__name__)
 
 # -------------------------------------------------
-# 1. Crear la aplicación de Telegram
+# 1. Crear las aplicaciones de Telegram (una por bot/tenant)
 # -------------------------------------------------
-request = HTTPXRequest(connect_timeout=15, read_timeout=15)
-application = (
-    Application.builder()
-    .token(TELEGRAM_TOKEN)
-    .request(request)
-    .build()
-)
+# Solo webhooks: ningún bot usa getUpdates, así que comparten un único cliente mínimo para eso
+peticiones_get_updates = HTTPXRequest(connection_pool_size=1)
 
-# -------------------------------------------------
-# 2. Registrar todos los handlers
-# -------------------------------------------------
-application.add_handler(CommandHandler("start", start_handler))
-application.add_handler(CommandHandler("confirmar_pago", confirmar_pago_handler))
-application.add_handler(CommandHandler("responder", responder_handler))
-application.add_handler(CommandHandler("r", responder_rapido_handler))
-application.add_handler(CommandHandler("pendientes", pendientes_handler))
-application.add_handler(CommandHandler("ultima", ultima_pregunta_handler))
-application.add_handler(CommandHandler("rapida", respuesta_rapida_handler))
-application.add_handler(CommandHandler("admin", admin_status_handler))
-for i in range(1, 10):
-    application.add_handler(CommandHandler(f"r{i}", responder_numerado_handler))
-application.add_handler(MessageHandler(filters.PHOTO, photo_handler))
-application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+def crear_aplicacion(tenant):
+    """Build a tenant's Telegram application; every bot shares the HTTP transport and the event loop."""
+    # Transporte con carriles separados: mensajes de texto y media (fotos, get_file)
+    application = (
+        Application.builder()
+        .token(tenant.token)
+        .request(transporte)
+        .get_updates_request(peticiones_get_updates)
+        .updater(None)
+        .build()
+    )
+
+    # -------------------------------------------------
+    # 2. Registrar todos los handlers
+    # -------------------------------------------------
+    # Antiflood por chat: corre antes que cualquier otro handler y corta el update si excede su cuota
+    application.add_handler(TypeHandler(Update, limitar_entrada_handler), group=-1)
+    application.add_handler(CommandHandler("start", start_handler))
+    application.add_handler(CommandHandler("confirmar_pago", confirmar_pago_handler))
+    application.add_handler(CommandHandler("responder", responder_handler))
+    application.add_handler(CommandHandler("r", responder_rapido_handler))
+    application.add_handler(CommandHandler("pendientes", pendientes_handler))
+    application.add_handler(CommandHandler("ultima", ultima_pregunta_handler))
+    application.add_handler(CommandHandler("rapida", respuesta_rapida_handler))
+    application.add_handler(CommandHandler("admin", admin_status_handler))
+    application.add_handler(CommandHandler("operadores", operadores_handler))
+    application.add_handler(CommandHandler("stats", stats_handler))
+    application.add_handler(CommandHandler("recargar", recargar_handler))
+    application.add_handler(CommandHandler("buscar", buscar_handler))
+    application.add_handler(CommandHandler("perfil", perfil_handler))
+    application.add_handler(CommandHandler("memoria", memoria_handler))
+    for i in range(1, 10):
+        application.add_handler(CommandHandler(f"r{i}", responder_numerado_handler))
+    # Botones de las notificaciones (confirmar, rechazar, responder, spam)
+    application.add_handler(CallbackQueryHandler(accion_handler))
+    application.add_handler(MessageHandler(filters.PHOTO, photo_handler))
+    # Operator replies to a notification are routed before the generic text handler
+    application.add_handler(MessageHandler(
+        filters.TEXT & filters.REPLY & ~filters.COMMAND & filters.Chat(chat_id=list(tenant.pool.operadores)),
+        respuesta_nativa_handler
+    ))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
+    return application
+
+for tenant in tenants.todos():
+    tenant.application = crear_aplicacion(tenant)
+
+# Event loop dedicado: Flask atiende HTTP en sus hilos y los updates de todos los bots se procesan aquí
+loop = asyncio.new_event_loop()
+threading.Thread(target=loop.run_forever, name="telegram-loop", daemon=True).start()
+# Watchdog: latido dentro del loop y un hilo aparte que detecta bloqueos y handlers colgados
+vigia.iniciar(loop)
 
 # -------------------------------------------------
 # 3. Flask app para webhook y keep-alive
@@ -69,28 +113,98 @@ flask_app = Flask(__name__)
 def ping():
     return "Bot alive", 200
 
-@flask_app.route(f"/{TELEGRAM_TOKEN}", methods=["POST"])
-def webhook():
+@flask_app.route("/ready")
+def ready():
+    # Salud real del loop: 503 solo cuando los updates dejaron de procesarse
+    estado = vigia.estado()
+    return jsonify(estado), 200 if estado['sano'] else 503
+
+async def procesar_update(tenant, secuencia, raw, datos=None):
+    """Process a journaled update and mark it done once its handlers finished."""
+    # Todo lo que corra dentro de este update (y las tareas que lance) ve el estado de este tenant
+    tenants.tenant_actual.set(tenant)
+    marca = vigia.comenzar(f"update #{secuencia} de {tenant.id}")
+    try:
+        update = Update.de_json(datos if datos is not None else cargar_json(raw), tenant.application.bot)
+        await tenant.application.process_update(update)
+    except Exception as e:
+        logger.error("Error processing update #%s of tenant %s: %s", secuencia, tenant.id, e)
+    finally:
+        vigia.terminar(marca)
+        tenant.bitacora.completar(secuencia)
+
+@flask_app.route("/<ruta>", methods=["POST"])
+def webhook(ruta):
+    # Cada bot tiene su propia ruta de webhook
+    tenant = tenants.por_ruta(ruta)
+    if tenant is None:
+        abort(404)
+    # Solo Telegram conoce el secreto: se rechaza antes de leer el cuerpo
+    if not autorizado(request.headers.get(CABECERA_SECRETO), tenant.secreto):
+        abort(403)
     if request.headers.get("content-type") == "application/json":
-        json_data = request.get_data().decode()
-        update = Update.de_json(json_data, application.bot)
-        asyncio.run_coroutine_threadsafe(
-            application.process_update(update),
-            application.bot.loop
-        )
+        raw = request.get_data()
+        try:
+            datos = cargar_json(raw)
+        except ValueError:
+            abort(400)
+        # Tipos sin handler (ediciones, stickers, canales...) se confirman sin construir objetos
+        if not isinstance(datos, dict) or clasificar(datos) is None:
+            evento(logger, 'update_ignorado', nivel=logging.DEBUG)
+            return "", 200
+        # Reintentos de Telegram: se confirman sin volver a procesarlos
+        update_id = datos.get("update_id")
+        if update_id is not None and not tenant.ventana_updates.registrar(update_id):
+            evento(logger, 'update_duplicado', tenant=tenant.id, update_id=update_id, total=tenant.ventana_updates.duplicados)
+            return "", 200
+        try:
+            secuencia = tenant.bitacora.anotar(raw)
+        except Exception as e:
+            # Sin registro durable no confirmamos: Telegram reintentará, y el reintento no debe verse como duplicado
+            logger.error("Could not journal update: %s", e)
+            if update_id is not None:
+                tenant.ventana_updates.olvidar(update_id)
+            return "", 500
+        asyncio.run_coroutine_threadsafe(procesar_update(tenant, secuencia, raw, datos), loop)
         return "", 200
     abort(403)
 
 # -------------------------------------------------
 # 4. Inicializar y setear webhook al arrancar
 # -------------------------------------------------
-async def set_webhook():
-    url = url = f"https://{os.getenv('KOYEB_PUBLIC_DOMAIN')}/{TELEGRAM_TOKEN}"
-    await application.bot.set_webhook(url, drop_pending_updates=True)
-    logger.info("Webhook configurado en %s", url)
+async def set_webhook(tenant):
+    url = f"https://{os.getenv('KOYEB_PUBLIC_DOMAIN')}/{tenant.ruta}"
+    # Conservamos los updates pendientes: nada se pierde durante un redeploy
+    await tenant.application.bot.set_webhook(
+        url,
+        drop_pending_updates=False,
+        allowed_updates=tipos_permitidos(),
+        secret_token=tenant.secreto
+    )
+    logger.info("Webhook de %s configurado", tenant.id)
+
+async def iniciar():
+    """Initialize every tenant's application, replay unfinished updates and register the webhooks."""
+    for tenant in tenants.todos():
+        # Las tareas creadas a partir de aquí heredan este tenant
+        tenants.tenant_actual.set(tenant)
+        # Un catálogo inválido al arrancar debe fallar aquí, no en el primer mensaje
+        tenant.catalogo.actual()
+        tenant.vigilante_catalogo = asyncio.create_task(tenant.catalogo.vigilar())
+        await tenant.application.initialize()
+        await asyncio.to_thread(tenant.busqueda.abrir)
+        tenant.guardado_busqueda = asyncio.create_task(tenant.busqueda.guardar_periodicamente())
+        for secuencia, raw in tenant.bitacora.abrir():
+            logger.info("Replaying journaled update #%s of tenant %s", secuencia, tenant.id)
+            # Si Telegram también lo reenvía, la ventana lo descartará
+            update_id = extraer_update_id(raw)
+            if update_id is not None:
+                tenant.ventana_updates.registrar(update_id)
+            asyncio.create_task(procesar_update(tenant, secuencia, raw))
+        await set_webhook(tenant)
 
 if __name__ == "__main__":
     # Preparar la app
-    asyncio.run(set_webhook())
+    asyncio.run_coroutine_threadsafe(iniciar(), loop).result()
     # Arrancar Flask (Gunicorn se encargará en producción)
     flask_app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,224 @@
+import asyncio
+import datetime
+import itertools
+import logging
+import threading
+
+from telegram.constants import ParseMode
+
+from config import ROL_ADMIN
+from entrega import enviar_texto, enviar_foto
+from tenants import Proxy
+
+logger = logging.getLogger(__name__)
+
+TICKET_PREGUNTA = "pregunta"
+TICKET_PAGO = "pago"
+
+class PoolOperadores:
+    """Pool of human operators that share incoming questions and payment receipts."""
+
+    def __init__(self, operadores, tiempo_reasignacion_minutos):
+        self.operadores = dict(operadores)
+        self.tiempo_reasignacion = datetime.timedelta(minutes=tiempo_reasignacion_minutos)
+        self.tickets = {}  # ticket_id -> ticket dict (open tickets only)
+        self.carga = {operador_id: 0 for operador_id in self.operadores}
+        self.ultimo_chat = {}  # operador_id -> last chat_id assigned to that operator
+        self._secuencia = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def es_operador(self, chat_id):
+        """Return True if chat_id belongs to any operator of the pool."""
+        return chat_id in self.operadores
+
+    def es_admin(self, chat_id):
+        """Return True if chat_id is an operator with admin role."""
+        operador = self.operadores.get(chat_id)
+        return operador is not None and operador['rol'] == ROL_ADMIN
+
+    def admins(self):
+        """Return the IDs of all admin operators."""
+        return [op_id for op_id, op in self.operadores.items() if op['rol'] == ROL_ADMIN]
+
+    def _peso(self, operador_id, servicio):
+        """Skill weight of an operator for a service (0 means not qualified)."""
+        servicios = self.operadores[operador_id]['servicios']
+        if not servicios:
+            return 1.0  # Generalists take everything
+        return servicios.get(servicio, 0.0)
+
+    def _elegir(self, servicio, excluir=()):
+        """Pick the least loaded operator, weighted by skill for the service."""
+        candidatos = [op_id for op_id in self.operadores if op_id not in excluir]
+        if not candidatos:
+            return None
+        calificados = [op_id for op_id in candidatos if self._peso(op_id, servicio) > 0]
+        if calificados:
+            return min(calificados, key=lambda op_id: (self.carga[op_id] + 1) / self._peso(op_id, servicio))
+        # Nobody has the skill: fall back to plain least outstanding tickets
+        return min(candidatos, key=lambda op_id: self.carga[op_id])
+
+    def _asignar(self, ticket, operador_id):
+        """Move a ticket to an operator and keep load counters in sync."""
+        anterior = ticket.get('operador')
+        if anterior is not None:
+            self.carga[anterior] -= 1
+        ticket['operador'] = operador_id
+        ticket['reclamado_por'] = None
+        ticket['ultima_actividad'] = datetime.datetime.now()
+        self.carga[operador_id] += 1
+        self.ultimo_chat[operador_id] = ticket['chat_id']
+
+    def crear_ticket(self, chat_id, tipo, servicio=None, mensaje=None, foto=None, unico=True):
+        """
+        Open a ticket and assign it to an operator.
+        With unico, a chat that already has an open ticket of the same type keeps it.
+        Otherwise a new ticket is opened, sticking to the operator already serving the chat.
+        Returns (ticket, is_new), or (None, False) if the pool is empty.
+        """
+        with self._lock:
+            operador_id = None
+            for ticket in self.tickets.values():
+                if ticket['chat_id'] != chat_id:
+                    continue
+                if unico and ticket['tipo'] == tipo:
+                    ticket['mensaje'] = mensaje
+                    ticket['foto'] = foto
+                    ticket['ultima_actividad'] = datetime.datetime.now()
+                    self.ultimo_chat[ticket['operador']] = chat_id
+                    return ticket, False
+                operador_id = ticket['operador']
+
+            if operador_id is None:
+                operador_id = self._elegir(servicio)
+            if operador_id is None:
+                return None, False
+
+            ticket = {
+                'id': next(self._secuencia),
+                'chat_id': chat_id,
+                'tipo': tipo,
+                'servicio': servicio,
+                'mensaje': mensaje,
+                'foto': foto,
+                'operador': None,
+                'reclamado_por': None,
+                'creado': datetime.datetime.now()
+            }
+            self._asignar(ticket, operador_id)
+            self.tickets[ticket['id']] = ticket
+            return ticket, True
+
+    def ticket_abierto(self, chat_id, tipo):
+        """Return the open ticket of a chat for the given type, if any."""
+        for ticket in self.tickets.values():
+            if ticket['chat_id'] == chat_id and ticket['tipo'] == tipo:
+                return ticket
+        return None
+
+    def reclamar(self, ticket_id, operador_id):
+        """
+        Atomically claim a ticket for an operator.
+        Returns True if the operator now owns it, False if someone else claimed it first.
+        """
+        with self._lock:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None:
+                return False
+            if ticket['reclamado_por'] not in (None, operador_id):
+                return False
+            if ticket['operador'] != operador_id:
+                self._asignar(ticket, operador_id)
+            ticket['reclamado_por'] = operador_id
+            ticket['ultima_actividad'] = datetime.datetime.now()
+            return True
+
+    def liberar(self, ticket_id, operador_id):
+        """Release a claim (e.g. when sending the answer failed)."""
+        with self._lock:
+            ticket = self.tickets.get(ticket_id)
+            if ticket and ticket['reclamado_por'] == operador_id:
+                ticket['reclamado_por'] = None
+
+    def cerrar(self, ticket_id):
+        """Close a ticket and free its operator's slot."""
+        with self._lock:
+            ticket = self.tickets.pop(ticket_id, None)
+            if ticket and ticket['operador'] is not None:
+                self.carga[ticket['operador']] -= 1
+            return ticket
+
+    def reasignar_si_inactivo(self, ticket_id, ahora=None):
+        """
+        Reassign an unclaimed ticket whose operator has been idle past the timeout.
+        Returns (ticket, previous_operator) if it moved, otherwise None.
+        """
+        ahora = ahora or datetime.datetime.now()
+        with self._lock:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None or ticket['reclamado_por'] is not None:
+                return None
+            if ahora - ticket['ultima_actividad'] < self.tiempo_reasignacion:
+                return None
+            anterior = ticket['operador']
+            nuevo = self._elegir(ticket['servicio'], excluir=(anterior,))
+            if nuevo is None:
+                ticket['ultima_actividad'] = ahora
+                return None
+            self._asignar(ticket, nuevo)
+            return ticket, anterior
+
+    def reclamar_de_chat(self, chat_id, tipo, operador_id):
+        """
+        Claim the open ticket of a chat for an operator.
+        Returns (ok, ticket); ticket is None when the chat has nothing open.
+        """
+        ticket = self.ticket_abierto(chat_id, tipo)
+        if ticket is None:
+            return True, None
+        return self.reclamar(ticket['id'], operador_id), ticket
+
+    def resumen(self):
+        """Return (operador_id, rol, carga) for every operator, busiest first."""
+        return sorted(
+            ((op_id, op['rol'], self.carga[op_id]) for op_id, op in self.operadores.items()),
+            key=lambda fila: -fila[2]
+        )
+
+pool = Proxy('pool')  # Operator pool of the current tenant
+
+async def vigilar_ticket(context, ticket_id):
+    """Reassign a ticket to another operator every time it sits idle past the timeout."""
+    import acciones
+    import services
+
+    while True:
+        await asyncio.sleep(pool.tiempo_reasignacion.total_seconds())
+        if ticket_id not in pool.tickets:
+            return
+
+        movido = pool.reasignar_si_inactivo(ticket_id)
+        if not movido:
+            continue
+
+        ticket, anterior = movido
+        aviso = f"🔁 **Ticket #{ticket['id']} reasignado** por inactividad del operador `{anterior}`.\n\n"
+        try:
+            if ticket.get('foto'):
+                enviados = await enviar_foto(
+                    context.bot, ticket['operador'], ticket['foto'], aviso + (ticket.get('mensaje') or ''),
+                    ParseMode.MARKDOWN, reply_markup=acciones.teclado(ticket)
+                )
+            else:
+                enviados = await enviar_texto(
+                    context.bot, ticket['operador'], aviso + (ticket.get('mensaje') or ''), ParseMode.MARKDOWN,
+                    reply_markup=acciones.teclado(ticket)
+                )
+            services.registrar_notificaciones(ticket, enviados)
+            await context.bot.send_message(
+                chat_id=anterior,
+                text=f"El ticket #{ticket['id']} (usuario {ticket['chat_id']}) fue reasignado a otro operador."
+            )
+            logger.info("Ticket %s reassigned from %s to %s", ticket['id'], anterior, ticket['operador'])
+        except Exception as e:
+            logger.error("Error notifying reassignment of ticket %s: %s", ticket['id'], e)
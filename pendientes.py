@@ -0,0 +1,131 @@
+import datetime
+import heapq
+import itertools
+import logging
+
+from config import TIEMPO_SESION_EXTENDIDA_MINUTOS, TIPO_SESION_EXTENDIDA, SLA_PREGUNTA_MINUTOS
+
+logger = logging.getLogger(__name__)
+
+class ColaPreguntas:
+    """
+    Pending questions ordered by deadline (earliest deadline first).
+
+    The deadline of a question is when it must be answered: SLA_PREGUNTA_MINUTOS after
+    it was asked, or earlier if the user's extended session runs out before that.
+    Older questions therefore rise naturally, and extended sessions close to expiring
+    jump ahead of standard ones. Several questions per chat are kept.
+    """
+
+    def __init__(self, sla_minutos=SLA_PREGUNTA_MINUTOS):
+        self.sla = datetime.timedelta(minutes=sla_minutos)
+        self._heap = []  # (limite, entrada_id)
+        self._entradas = {}  # entrada_id -> entrada
+        self._por_chat = {}  # chat_id -> set of entrada_id
+        self._secuencia = itertools.count(1)
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def __bool__(self):
+        return bool(self._entradas)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._por_chat
+
+    def calcular_limite(self, timestamp, tipo_sesion=None, inicio_sesion=None):
+        """Deadline for a question asked at timestamp in the given session."""
+        limite = timestamp + self.sla
+        if tipo_sesion == TIPO_SESION_EXTENDIDA and inicio_sesion:
+            fin_sesion = inicio_sesion + datetime.timedelta(minutes=TIEMPO_SESION_EXTENDIDA_MINUTOS)
+            limite = min(limite, fin_sesion)
+        return limite
+
+    def agregar(self, chat_id, nombre, pregunta, ticket=None, tipo_sesion=None, inicio_sesion=None):
+        """Queue a question and return its entry."""
+        timestamp = datetime.datetime.now()
+        entrada = {
+            'id': next(self._secuencia),
+            'chat_id': chat_id,
+            'nombre': nombre,
+            'pregunta': pregunta,
+            'timestamp': timestamp,
+            'tipo_sesion': tipo_sesion,
+            'limite': self.calcular_limite(timestamp, tipo_sesion, inicio_sesion),
+            'ticket': ticket,
+            'alertada': False,
+            'fusionadas': 0
+        }
+        self._entradas[entrada['id']] = entrada
+        self._por_chat.setdefault(chat_id, set()).add(entrada['id'])
+        heapq.heappush(self._heap, (entrada['limite'], entrada['id']))
+        return entrada
+
+    def quitar(self, entrada_id):
+        """Remove an entry (lazy deletion from the heap)."""
+        entrada = self._entradas.pop(entrada_id, None)
+        if entrada is None:
+            return None
+        ids_chat = self._por_chat.get(entrada['chat_id'])
+        if ids_chat is not None:
+            ids_chat.discard(entrada_id)
+            if not ids_chat:
+                del self._por_chat[entrada['chat_id']]
+        # Drop stale heap tops so peeking stays O(1), and compact when mostly stale
+        while self._heap and self._heap[0][1] not in self._entradas:
+            heapq.heappop(self._heap)
+        if len(self._heap) > 2 * len(self._entradas) + 64:
+            self._heap = [(e['limite'], e['id']) for e in self._entradas.values()]
+            heapq.heapify(self._heap)
+        return entrada
+
+    def ordenadas(self):
+        """All pending entries, most urgent first."""
+        return sorted(self._entradas.values(), key=lambda e: (e['limite'], e['id']))
+
+    def mas_urgente(self, filtro=None):
+        """Most urgent entry, optionally the first one matching filtro(entrada)."""
+        if filtro is None:
+            while self._heap:
+                entrada = self._entradas.get(self._heap[0][1])
+                if entrada is not None:
+                    return entrada
+                heapq.heappop(self._heap)
+            return None
+        for entrada in self.ordenadas():
+            if filtro(entrada):
+                return entrada
+        return None
+
+    def fusionar(self, chat_id, texto):
+        """Append text to the chat's newest pending question. Returns the entry, or None if there is none."""
+        ids_chat = self._por_chat.get(chat_id)
+        if not ids_chat:
+            return None
+        entrada = self._entradas[max(ids_chat)]
+        entrada['pregunta'] = f"{entrada['pregunta']}\n{texto}"
+        entrada['fusionadas'] += 1
+        return entrada
+
+    def de_chat(self, chat_id):
+        """Entries of a chat, most urgent first."""
+        entradas = [self._entradas[i] for i in self._por_chat.get(chat_id, ())]
+        return sorted(entradas, key=lambda e: (e['limite'], e['id']))
+
+    def en_riesgo(self, umbral, ahora=None):
+        """Entries not yet alerted whose deadline is within umbral (a timedelta)."""
+        ahora = ahora or datetime.datetime.now()
+        corte = ahora + umbral
+        riesgo = []
+        # Walk only the heap subtrees whose root is inside the window
+        pila = [0] if self._heap else []
+        while pila:
+            i = pila.pop()
+            limite, entrada_id = self._heap[i]
+            if limite > corte:
+                continue
+            entrada = self._entradas.get(entrada_id)
+            if entrada is not None and not entrada['alertada']:
+                riesgo.append(entrada)
+            pila.extend(hijo for hijo in (2 * i + 1, 2 * i + 2) if hijo < len(self._heap))
+        return riesgo
@@ -1,66 +1,170 @@
+import asyncio
+import datetime
 import logging
 from telegram.constants import ParseMode
-from config import YOUR_TELEGRAM_ID
+from telegram.error import BadRequest
+from config import ALERTA_RIESGO_MINUTOS
+from operators import pool, vigilar_ticket, TICKET_PREGUNTA
+from logs import evento
+from entrega import enviar_texto, escapar, escapar_codigo, LIMITE_MENSAJE
+import acciones
+import catalogo
+import tenants
 
 logger = logging.getLogger(__name__)
 
+# Merged messages are shown to the operator at most once per this many seconds and ticket
+ESPERA_REFRESCO_SEGUNDOS = 1.0
+
+def _mensaje_pregunta(chat_id, nombre_usuario, pregunta, limite, fusionadas=0):
+    """Operator notification for a queued question."""
+    # Format for easy copy-paste to ChatGPT
+    consulta_formateada = escapar_codigo(f'"{nombre_usuario}: {pregunta}"')
+    aviso_fusionadas = f"➕ **+{fusionadas} mensajes** enviados seguidos, incluidos en la consulta\n" if fusionadas else ""
+    return (
+        f"**📝 Nueva Pregunta de Usuario**\n\n"
+        f"👤 **{escapar(nombre_usuario)}** (ID: `{chat_id}`)\n"
+        f"⏳ **Responder antes de:** {limite.strftime('%H:%M')}\n"
+        f"{aviso_fusionadas}\n"
+        f"💬 **Consulta para ChatGPT:**\n"
+        f"`{consulta_formateada}`\n\n"
+        f"↩️ **Responde a este mensaje** para contestarle directamente\n"
+        f"⚡ **Responder rápido:** `/r [tu_respuesta]`\n"
+        f"📋 **Ver pendientes:** `/pendientes`\n"
+        f"🔄 **Última pregunta:** `/ultima`"
+    )
+
+def registrar_notificaciones(ticket, enviados):
+    """Index the messages announcing a ticket and remember them on the ticket, so they can be updated."""
+    import utils
+    for notificacion in enviados:
+        utils.notificaciones_admin.registrar(ticket['operador'], notificacion.message_id, ticket['chat_id'], ticket['id'])
+    ticket['notificacion'] = (ticket['operador'], [m.message_id for m in enviados])
+
 async def notify_admin_user_question(context, chat_id, nombre_usuario, pregunta):
-    """Notify admin about user question in active session."""
-    if not YOUR_TELEGRAM_ID:
-        logger.error("YOUR_TELEGRAM_ID not configured. Cannot notify admin.")
+    """Notify the least loaded operator about a user question in active session."""
+    if not pool.operadores:
+        logger.error("No operators configured. Cannot notify admin.")
         return
     
     # Store as last user who asked a question for /r command
     import utils
-    utils.ultimo_usuario_pregunta = chat_id
+    tenants.actual().ultimo_usuario_pregunta = chat_id
     
-    # Store in pending questions with timestamp
-    import datetime
-    utils.preguntas_pendientes[chat_id] = {
-        'nombre': nombre_usuario,
-        'pregunta': pregunta,
-        'timestamp': datetime.datetime.now()
-    }
+    sesion = utils.conversaciones_usuarios.get(chat_id, {})
     
     try:
-        # Format for easy copy-paste to ChatGPT
-        consulta_formateada = f'"{nombre_usuario}: {pregunta}"'
+        limite = utils.preguntas_pendientes.calcular_limite(
+            datetime.datetime.now(), sesion.get('tipo_sesion'), sesion.get('inicio')
+        )
+        mensaje_admin = _mensaje_pregunta(chat_id, nombre_usuario, pregunta, limite)
         
-        mensaje_admin = (
-            f"**📝 Nueva Pregunta de Usuario**\n\n"
-            f"👤 **{nombre_usuario}** (ID: `{chat_id}`)\n\n"
-            f"💬 **Consulta para ChatGPT:**\n"
-            f"`{consulta_formateada}`\n\n"
-            f"⚡ **Responder rápido:** `/r [tu_respuesta]`\n"
-            f"📋 **Ver pendientes:** `/pendientes`\n"
-            f"🔄 **Última pregunta:** `/ultima`"
+        ticket, nuevo = pool.crear_ticket(
+            chat_id, TICKET_PREGUNTA, sesion.get('servicio'), mensaje=mensaje_admin, unico=False
         )
         
-        await context.bot.send_message(
-            chat_id=YOUR_TELEGRAM_ID,
-            text=mensaje_admin,
-            parse_mode=ParseMode.MARKDOWN
+        # Queue by deadline (one entry per question)
+        utils.preguntas_pendientes.agregar(
+            chat_id, nombre_usuario, pregunta, ticket['id'],
+            sesion.get('tipo_sesion'), sesion.get('inicio')
         )
-        logger.info(f"User question notification sent to admin for {chat_id}")
+        asegurar_monitor_riesgo(context)
+        
+        # Long questions span several messages; replying to any of them answers the user
+        enviados = await enviar_texto(
+            context.bot, ticket['operador'], mensaje_admin, ParseMode.MARKDOWN, reply_markup=acciones.teclado(ticket)
+        )
+        registrar_notificaciones(ticket, enviados)
+        if nuevo:
+            asyncio.create_task(vigilar_ticket(context, ticket['id']))
+        evento(logger, 'notificacion_enviada', chat_id=chat_id, operador=ticket['operador'], ticket=ticket['id'])
         
     except Exception as e:
-        logger.error(f"Error sending user question notification: {e}")
+        logger.error("Error sending user question notification: %s", e)
 
-def format_service_name(servicio):
-    """Format service name for display."""
-    service_names = {
-        'coach_motivacional': 'Coach Motivacional',
-        'apoyo_emocional': 'Apoyo Emocional',
-        'ayuda_docentes': 'Ayuda para Docentes'
-    }
-    return service_names.get(servicio, servicio)
+def programar_refresco(context, entrada):
+    """Show the operator the messages merged into a queued question (coalesced per ticket)."""
+    ticket = pool.tickets.get(entrada['ticket'])
+    if ticket is None or ticket.get('refresco_pendiente'):
+        return
+    ticket['refresco_pendiente'] = True
+    asyncio.create_task(_refrescar_notificacion(context, ticket, entrada))
 
-def format_session_name(tipo_sesion):
-    """Format session type name for display."""
-    session_names = {
-        'sesion_estandar': 'Sesión Estándar',
-        'sesion_extendida': 'Sesión Extendida'
-    }
+async def _refrescar_notificacion(context, ticket, entrada):
+    """Rewrite a question's notification with its merged text, editing it in place when possible."""
+    await asyncio.sleep(ESPERA_REFRESCO_SEGUNDOS)
+    ticket['refresco_pendiente'] = False
+    if ticket['id'] not in pool.tickets:
+        return
+    mensaje = _mensaje_pregunta(
+        entrada['chat_id'], entrada['nombre'], entrada['pregunta'], entrada['limite'], entrada['fusionadas']
+    )
+    # Reassignments resend ticket['mensaje'], so it must carry the merged text too
+    ticket['mensaje'] = mensaje
+    teclado = acciones.teclado(ticket)
+    operador, ids = ticket.get('notificacion') or (None, [])
+    try:
+        if operador == ticket['operador'] and len(ids) == 1 and len(mensaje) <= LIMITE_MENSAJE:
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=operador, message_id=ids[0], text=mensaje,
+                    parse_mode=ParseMode.MARKDOWN, reply_markup=teclado
+                )
+                return
+            except BadRequest as e:
+                logger.debug("Could not edit notification of ticket %s, resending: %s", ticket['id'], e)
+        enviados = await enviar_texto(context.bot, ticket['operador'], mensaje, ParseMode.MARKDOWN, reply_markup=teclado)
+        registrar_notificaciones(ticket, enviados)
+        evento(logger, 'notificacion_actualizada', chat_id=entrada['chat_id'], ticket=ticket['id'], fusionadas=entrada['fusionadas'])
+    except Exception as e:
+        logger.error("Error updating notification of ticket %s: %s", ticket['id'], e)
 
+def asegurar_monitor_riesgo(context):
+    """Start the at-risk question monitor once, from inside the running event loop."""
+    tenant = tenants.actual()
+    if tenant.monitor_riesgo is None or tenant.monitor_riesgo.done():
+        tenant.monitor_riesgo = asyncio.create_task(monitorear_preguntas_en_riesgo(context))
 
-    
+async def monitorear_preguntas_en_riesgo(context, intervalo=30):
+    """Alert the assigned operator (and admins) about questions about to miss their deadline."""
+    import utils
+
+    umbral = datetime.timedelta(minutes=ALERTA_RIESGO_MINUTOS)
+    while True:
+        await asyncio.sleep(intervalo)
+        ahora = datetime.datetime.now()
+        for entrada in utils.preguntas_pendientes.en_riesgo(umbral, ahora):
+            entrada['alertada'] = True
+            minutos = max(0, int((entrada['limite'] - ahora).total_seconds() // 60))
+            ticket = pool.tickets.get(entrada['ticket'])
+            destinatarios = set(pool.admins())
+            if ticket:
+                destinatarios.add(ticket['operador'])
+            mensaje = (
+                f"⚠️ **Pregunta en riesgo** de {escapar(entrada['nombre'])} (ID: `{entrada['chat_id']}`)\n"
+                f"Quedan {minutos} min antes del límite ({entrada['limite'].strftime('%H:%M')}).\n"
+                f"↩️ Responde a este mensaje para contestarle."
+            )
+            for destinatario in destinatarios:
+                try:
+                    enviados = await enviar_texto(
+                        context.bot, destinatario, mensaje, ParseMode.MARKDOWN,
+                        reply_markup=acciones.teclado(ticket) if ticket else None
+                    )
+                    for alerta in enviados:
+                        utils.notificaciones_admin.registrar(
+                            destinatario, alerta.message_id, entrada['chat_id'], entrada['ticket']
+                        )
+                except Exception as e:
+                    logger.error("Error sending at-risk alert to %s: %s", destinatario, e)
+            logger.info("At-risk alert sent for question %s of %s", entrada['id'], entrada['chat_id'])
+
+def format_service_name(servicio, cat=None):
+    """Format service name for display."""
+    cat = cat or catalogo.actual()
+    return cat.nombres_servicio.get(servicio, servicio)
+
+def format_session_name(tipo_sesion, cat=None):
+    """Format session type name for display."""
+    cat = cat or catalogo.actual()
+    return cat.nombres_sesion.get(tipo_sesion, tipo_sesion)
@@ -0,0 +1,192 @@
+import contextvars
+import json
+import logging
+import os
+import re
+
+from config import (
+    TELEGRAM_TOKEN, WEBHOOK_SECRET, OPERADORES,
+    NUMERO_TELEFONO, CEDULA_IDENTIDAD, BANCO, TASA_BCV,
+    TIEMPO_REASIGNACION_MINUTOS, DATA_DIR, BITACORA_MAX_BYTES, CATALOGO_RUTA,
+    FLOOD_RAFAGA, FLOOD_SEGUNDOS_POR_MENSAJE, FLOOD_MAX_INFRACCIONES, FLOOD_SILENCIO_MINUTOS,
+    TENANTS_RUTA, parsear_operadores, secreto_webhook
+)
+
+logger = logging.getLogger(__name__)
+
+PATRON_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Tenant whose update is being handled; set per update task, inherited by the tasks it spawns
+tenant_actual = contextvars.ContextVar('tenant_actual')
+
+class Tenant:
+    """One advisor bot: credentials, payment details and all of its namespaced state."""
+
+    def __init__(self, id, token, operadores, secreto=None, numero_telefono=None, cedula_identidad=None,
+                 banco=None, tasa_bcv=TASA_BCV, catalogo_ruta=CATALOGO_RUTA, directorio=DATA_DIR):
+        # Imported here: these modules expose tenant proxies and therefore import this one
+        from operators import PoolOperadores
+        from pendientes import ColaPreguntas
+        from utils import IndiceNotificaciones
+        from catalogo import GestorCatalogo
+        from eventos import RegistroEventos
+        from bitacora import BitacoraIngreso
+        from duplicados import VentanaUpdates
+        from limitador import LimitadorChats
+        from busqueda import IndiceBusqueda
+        from acciones import RegistroAcciones
+
+        self.id = id
+        self.token = token
+        self.ruta = token
+        self.secreto = secreto or secreto_webhook(token)
+        self.numero_telefono = numero_telefono
+        self.cedula_identidad = cedula_identidad
+        self.banco = banco
+        self.tasa_bcv = tasa_bcv
+        self.directorio = directorio
+
+        self.pool = PoolOperadores(operadores, TIEMPO_REASIGNACION_MINUTOS)
+        self.preguntas_pendientes = ColaPreguntas()
+        self.notificaciones_admin = IndiceNotificaciones()
+        self.pagos_pendientes = {}
+        self.conversaciones_usuarios = {}
+        self.user_last_interaction = {}
+        self.ultimo_usuario_pregunta = None
+        self.catalogo = GestorCatalogo(catalogo_ruta)
+        self.eventos = RegistroEventos(os.path.join(directorio, 'eventos'))
+        self.bitacora = BitacoraIngreso(os.path.join(directorio, 'ingreso.journal'), BITACORA_MAX_BYTES)
+        self.ventana_updates = VentanaUpdates()
+        self.busqueda = IndiceBusqueda(os.path.join(directorio, 'busqueda'))
+        self.acciones = RegistroAcciones(token)
+        self.limitador = LimitadorChats(
+            FLOOD_RAFAGA, FLOOD_SEGUNDOS_POR_MENSAJE, FLOOD_MAX_INFRACCIONES, FLOOD_SILENCIO_MINUTOS * 60
+        )
+
+        self.application = None
+        self.monitor_riesgo = None
+        self.vigilante_catalogo = None
+        self.guardado_busqueda = None
+
+    def __repr__(self):
+        return f"<Tenant {self.id}>"
+
+    def pago_configurado(self):
+        """True if this bot can show payment instructions."""
+        return all([self.numero_telefono, self.cedula_identidad, self.banco, self.tasa_bcv])
+
+class Proxy:
+    """
+    Stand-in for a per-tenant object, resolved on every access.
+
+    Module globals such as utils.pagos_pendientes or operators.pool are proxies, so
+    existing `from utils import pagos_pendientes` code transparently reads the state
+    of the tenant handling the current update.
+    """
+
+    __slots__ = ('_atributo',)
+
+    def __init__(self, atributo):
+        object.__setattr__(self, '_atributo', atributo)
+
+    def _objetivo(self):
+        return getattr(actual(), self._atributo)
+
+    def __getattr__(self, nombre):
+        return getattr(self._objetivo(), nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._objetivo(), nombre, valor)
+
+    def __getitem__(self, clave):
+        return self._objetivo()[clave]
+
+    def __setitem__(self, clave, valor):
+        self._objetivo()[clave] = valor
+
+    def __delitem__(self, clave):
+        del self._objetivo()[clave]
+
+    def __contains__(self, clave):
+        return clave in self._objetivo()
+
+    def __iter__(self):
+        return iter(self._objetivo())
+
+    def __len__(self):
+        return len(self._objetivo())
+
+    def __bool__(self):
+        return bool(self._objetivo())
+
+    def __repr__(self):
+        return f"<Proxy {self._atributo}>"
+
+def _desde_entorno():
+    """Single-tenant mode: the bot configured through the classic environment variables."""
+    return [Tenant(
+        'principal', TELEGRAM_TOKEN, OPERADORES, secreto=WEBHOOK_SECRET,
+        numero_telefono=NUMERO_TELEFONO, cedula_identidad=CEDULA_IDENTIDAD, banco=BANCO
+    )]
+
+def _desde_archivo(ruta):
+    """Multi-tenant mode: one bot per entry of the JSON registry, each with its own data directory."""
+    with open(ruta, encoding='utf-8') as f:
+        entradas = json.load(f)
+    if not isinstance(entradas, list) or not entradas:
+        raise ValueError(f"{ruta} must contain a non-empty list of tenants")
+
+    base = os.path.dirname(os.path.abspath(ruta))
+    tenants, ids, tokens = [], set(), set()
+    for entrada in entradas:
+        tenant_id = entrada.get('id')
+        token = entrada.get('token')
+        if not isinstance(tenant_id, str) or not PATRON_ID.match(tenant_id) or tenant_id in ids:
+            raise ValueError(f"Tenant id '{tenant_id}' is missing, invalid or duplicated")
+        if not token or token in tokens:
+            raise ValueError(f"Tenant '{tenant_id}' has a missing or duplicated token")
+        ids.add(tenant_id)
+        tokens.add(token)
+
+        admin_id = entrada.get('admin')
+        catalogo_ruta = entrada.get('catalogo')
+        tenants.append(Tenant(
+            tenant_id, token,
+            parsear_operadores(entrada.get('operadores'), int(admin_id) if admin_id else None),
+            secreto=entrada.get('secreto'),
+            numero_telefono=entrada.get('numero_telefono'),
+            cedula_identidad=entrada.get('cedula_identidad'),
+            banco=entrada.get('banco'),
+            tasa_bcv=float(entrada.get('tasa_bcv', TASA_BCV)),
+            catalogo_ruta=os.path.join(base, catalogo_ruta) if catalogo_ruta else CATALOGO_RUTA,
+            directorio=os.path.join(DATA_DIR, tenant_id)
+        ))
+    return tenants
+
+_tenants = None
+_por_ruta = {}
+
+def todos():
+    """All tenants served by this process (loaded on first use)."""
+    global _tenants
+    if _tenants is None:
+        tenants = _desde_archivo(TENANTS_RUTA) if TENANTS_RUTA else _desde_entorno()
+        _por_ruta.update((tenant.ruta, tenant) for tenant in tenants)
+        _tenants = tenants
+        logger.info("Serving %s tenant(s): %s", len(tenants), ", ".join(t.id for t in tenants))
+    return _tenants
+
+def por_ruta(ruta):
+    """Tenant owning a webhook path, or None."""
+    todos()
+    return _por_ruta.get(ruta)
+
+def actual():
+    """Tenant of the current update. Outside an update this is only defined when there is a single tenant."""
+    tenant = tenant_actual.get(None)
+    if tenant is not None:
+        return tenant
+    tenants = todos()
+    if len(tenants) == 1:
+        return tenants[0]
+    raise LookupError("No tenant bound to the current context")
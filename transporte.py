@@ -0,0 +1,176 @@
+import asyncio
+import importlib.util
+import logging
+import time
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+from config import (
+    HTTP_VERSION, HTTP_KEEPALIVE_SEGUNDOS,
+    HTTP_POOL_MENSAJES, HTTP_TIMEOUT_MENSAJES, HTTP_POOL_TIMEOUT_MENSAJES,
+    HTTP_POOL_MEDIA, HTTP_TIMEOUT_MEDIA, HTTP_POOL_TIMEOUT_MEDIA
+)
+
+logger = logging.getLogger(__name__)
+
+# Bot API methods that upload or download files go through the media lane
+METODOS_MEDIA = {
+    'sendPhoto', 'sendDocument', 'sendVideo', 'sendAudio', 'sendVoice', 'sendAnimation',
+    'sendVideoNote', 'sendSticker', 'sendMediaGroup', 'getFile'
+}
+
+# Concurrent streams allowed per HTTP/2 connection before we count a request as waiting
+STREAMS_POR_CONEXION_H2 = 100
+
+class CarrilHTTP(HTTPXRequest):
+    """HTTPXRequest with keep-alive tuning and pool saturation metrics."""
+
+    def __init__(self, nombre, connection_pool_size, keepalive_segundos, pool_timeout, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, pool_timeout=pool_timeout, **kwargs)
+        self.nombre = nombre
+        self.tamano_pool = connection_pool_size
+        self.timeout_pool = pool_timeout
+        # HTTPXRequest does not expose keepalive_expiry, so rebuild the client with tuned limits
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_segundos
+        )
+        self._client = self._build_client()
+
+        capacidad = connection_pool_size
+        if self.http_version != '1.1':
+            capacidad *= STREAMS_POR_CONEXION_H2
+        self.capacidad = capacidad
+        self._cupos = asyncio.Semaphore(capacidad)
+
+        self.solicitudes = 0
+        self.en_vuelo = 0
+        self.pico_en_vuelo = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts_pool = 0
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        """Wait for a free slot (measuring the wait) and run the request."""
+        self.solicitudes += 1
+        inicio = time.perf_counter()
+        if self._cupos.locked():
+            self.esperas += 1
+            limite = self.timeout_pool if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout
+            try:
+                await asyncio.wait_for(self._cupos.acquire(), limite)
+            except asyncio.TimeoutError:
+                self.timeouts_pool += 1
+                raise TimedOut(f"Pool timeout in {self.nombre} lane: {self.capacidad} requests in flight.")
+        else:
+            await self._cupos.acquire()
+        espera = time.perf_counter() - inicio
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+
+        # HTTPXRequest hard-codes 20s for uploads; honour this lane's own write timeout instead
+        if write_timeout is BaseRequest.DEFAULT_NONE:
+            write_timeout = self._client.timeout.write
+
+        self.en_vuelo += 1
+        self.pico_en_vuelo = max(self.pico_en_vuelo, self.en_vuelo)
+        try:
+            return await super().do_request(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        finally:
+            self.en_vuelo -= 1
+            self._cupos.release()
+
+    def metricas(self):
+        """Snapshot of saturation counters for this lane."""
+        return {
+            'nombre': self.nombre,
+            'http': self.http_version,
+            'conexiones': self.tamano_pool,
+            'capacidad': self.capacidad,
+            'en_vuelo': self.en_vuelo,
+            'pico_en_vuelo': self.pico_en_vuelo,
+            'solicitudes': self.solicitudes,
+            'esperas': self.esperas,
+            'espera_media_ms': self.espera_total * 1000 / self.solicitudes if self.solicitudes else 0.0,
+            'espera_max_ms': self.espera_max * 1000,
+            'timeouts_pool': self.timeouts_pool
+        }
+
+class TransporteCarriles(BaseRequest):
+    """
+    Bot API transport that routes each call to its own connection pool:
+    text messages never queue behind a slow receipt upload or download.
+    """
+
+    def __init__(self, mensajes, media):
+        self.mensajes = mensajes
+        self.media = media
+
+    @property
+    def read_timeout(self):
+        return self.mensajes.read_timeout
+
+    def carril(self, url, request_data=None):
+        """Pick the lane for a Bot API URL."""
+        if '/file/bot' in url:
+            return self.media
+        if request_data is not None and request_data.contains_files:
+            return self.media
+        if url.rsplit('/', 1)[-1] in METODOS_MEDIA:
+            return self.media
+        return self.mensajes
+
+    async def initialize(self):
+        await self.mensajes.initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await self.mensajes.shutdown()
+        await self.media.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        return await self.carril(url, request_data).do_request(
+            url, method, request_data,
+            read_timeout=read_timeout, write_timeout=write_timeout,
+            connect_timeout=connect_timeout, pool_timeout=pool_timeout
+        )
+
+    def metricas(self):
+        """Saturation counters for both lanes."""
+        return [self.mensajes.metricas(), self.media.metricas()]
+
+def _version_http():
+    """Use HTTP/2 when configured and the h2 package is available, else HTTP/1.1."""
+    if HTTP_VERSION in ('2', '2.0') and importlib.util.find_spec('h2') is None:
+        logger.warning("HTTP/2 requested but 'h2' is not installed. Falling back to HTTP/1.1.")
+        return '1.1'
+    return HTTP_VERSION
+
+def crear_transporte():
+    """Build the two-lane transport from configuration."""
+    version = _version_http()
+    mensajes = CarrilHTTP(
+        'mensajes', HTTP_POOL_MENSAJES, HTTP_KEEPALIVE_SEGUNDOS, HTTP_POOL_TIMEOUT_MENSAJES,
+        connect_timeout=HTTP_TIMEOUT_MENSAJES, read_timeout=HTTP_TIMEOUT_MENSAJES,
+        write_timeout=HTTP_TIMEOUT_MENSAJES, http_version=version
+    )
+    media = CarrilHTTP(
+        'media', HTTP_POOL_MEDIA, HTTP_KEEPALIVE_SEGUNDOS, HTTP_POOL_TIMEOUT_MEDIA,
+        connect_timeout=HTTP_TIMEOUT_MENSAJES, read_timeout=HTTP_TIMEOUT_MEDIA,
+        write_timeout=HTTP_TIMEOUT_MEDIA, http_version=version
+    )
+    return TransporteCarriles(mensajes, media)
+
+transporte = crear_transporte()
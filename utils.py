@@ -2,18 +2,64 @@ import asyncio
 import logging
 import uuid
 import os
+import re
 import datetime
+from collections import OrderedDict
 from telegram import ReplyKeyboardMarkup
 from config import TIEMPO_SESION_EXTENDIDA_MINUTOS, TIPO_SESION_EXTENDIDA
+from tenants import Proxy
+import eventos
+import catalogo
 
 logger = logging.getLogger(__name__)
 
-# Global storage for user data
-pagos_pendientes = {}
-conversaciones_usuarios = {}
-ultimo_usuario_pregunta = None  # Store last user who asked a question
-preguntas_pendientes = {}  # Store pending questions with timestamps
-user_last_interaction = {}  # Track last interaction time to detect returning users
+VOLVER_MENU = '🏠 Volver al Menú Principal'
+
+class IndiceNotificaciones:
+    """
+    Bounded LRU index from an operator notification to the question it announces.
+    Keys are (operator_chat_id, message_id) because message IDs are only unique per chat.
+    """
+
+    def __init__(self, capacidad=5000):
+        self.capacidad = capacidad
+        self._entradas = OrderedDict()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def registrar(self, operador_id, message_id, chat_id, ticket_id):
+        """Remember that message_id in the operator's chat refers to (chat_id, ticket_id)."""
+        clave = (operador_id, message_id)
+        self._entradas[clave] = (chat_id, ticket_id)
+        self._entradas.move_to_end(clave)
+        if len(self._entradas) > self.capacidad:
+            self._entradas.popitem(last=False)
+
+    def buscar(self, operador_id, message_id):
+        """Return (chat_id, ticket_id) for a notification, or None if unknown or evicted."""
+        clave = (operador_id, message_id)
+        destino = self._entradas.get(clave)
+        if destino is not None:
+            self._entradas.move_to_end(clave)
+        return destino
+
+# User data, namespaced per tenant (see tenants.Tenant for the underlying objects)
+pagos_pendientes = Proxy('pagos_pendientes')
+conversaciones_usuarios = Proxy('conversaciones_usuarios')
+preguntas_pendientes = Proxy('preguntas_pendientes')  # Pending questions ordered by deadline
+user_last_interaction = Proxy('user_last_interaction')  # Track last interaction time to detect returning users
+notificaciones_admin = Proxy('notificaciones_admin')  # Operator notification message -> (chat_id, ticket)
+
+def registrar_fin_sesion(chat_id):
+    """Log the end of a session with its duration in seconds."""
+    sesion = conversaciones_usuarios[chat_id]
+    inicio = sesion.get('inicio')
+    eventos.registrar_evento(
+        eventos.SESION_FINALIZADA, chat_id,
+        servicio=sesion.get('servicio'), tipo_sesion=sesion.get('tipo_sesion'),
+        valor=(datetime.datetime.now() - inicio).total_seconds() if inicio else 0
+    )
 
 async def finalizar_sesion_estandar(context, chat_id):
     """Send message to client indicating that standard session has ended."""
@@ -21,12 +67,7 @@ async def finalizar_sesion_estandar(context, chat_id):
         return
     
     nombre_usuario = conversaciones_usuarios[chat_id]['nombre_usuario']
-    keyboard = [
-        ['⭐ Sesión Estándar (2$)'],
-        ['💎 Sesión Extendida (4$)'],
-        ['🏠 Volver al Menú Principal']
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = ReplyKeyboardMarkup(generate_session_keyboard(), resize_keyboard=True)
     mensaje = (
         f"¡Tu sesión estándar ha finalizado, {nombre_usuario}! 🎉\n\n"
         "Espero haber resuelto tu consulta.\n\n"
@@ -42,9 +83,10 @@ async def finalizar_sesion_estandar(context, chat_id):
         )
         # Mark session as finished
         conversaciones_usuarios[chat_id]['estado'] = 'finalizada'
-        logger.info(f"Standard session finished for {chat_id}.")
+        logger.info("Standard session finished for %s.", chat_id)
+        registrar_fin_sesion(chat_id)
     except Exception as e:
-        logger.error(f"Error sending standard session finish message to {chat_id}: {e}")
+        logger.error("Error sending standard session finish message to %s: %s", chat_id, e)
 
 async def iniciar_temporizador_extendida(context, chat_id):
     """Start a 20-minute timer for extended session."""
@@ -52,12 +94,7 @@ async def iniciar_temporizador_extendida(context, chat_id):
     
     if chat_id in conversaciones_usuarios and conversaciones_usuarios[chat_id].get('tipo_sesion') == TIPO_SESION_EXTENDIDA:
         nombre_usuario = conversaciones_usuarios[chat_id]['nombre_usuario']
-        keyboard = [
-            ['⭐ Sesión Estándar (2$)'],
-            ['💎 Sesión Extendida (4$)'],
-            ['🏠 Volver al Menú Principal']
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup = ReplyKeyboardMarkup(generate_session_keyboard(), resize_keyboard=True)
         mensaje = (
             f"⏰ ¡Tiempo cumplido, {nombre_usuario}!\n\n"
             "Tu sesión extendida de 20 minutos ha finalizado.\n\n"
@@ -71,28 +108,34 @@ async def iniciar_temporizador_extendida(context, chat_id):
                 reply_markup=reply_markup
             )
             conversaciones_usuarios[chat_id]['estado'] = 'expirada_extendida'
-            logger.info(f"Extended session expired for {chat_id}.")
+            logger.info("Extended session expired for %s.", chat_id)
+            registrar_fin_sesion(chat_id)
         except Exception as e:
-            logger.error(f"Error expiring extended session for {chat_id}: {e}")
+            logger.error("Error expiring extended session for %s: %s", chat_id, e)
 
-def generate_service_keyboard():
+def generate_service_keyboard(cat=None):
     """Generate the main service selection keyboard."""
-    return [['🚀 Coach Motivacional', '💙 Apoyo Emocional'], ['📚 Ayuda para Docentes']]
+    cat = cat or catalogo.actual()
+    return [list(fila) for fila in cat.teclado_servicios]
 
-def generate_session_keyboard():
+def generate_session_keyboard(cat=None):
     """Generate session type selection keyboard."""
-    return [
-        ['⭐ Sesión Estándar (2$)'],
-        ['💎 Sesión Extendida (4$)'],
-        ['🏠 Volver al Menú Principal']
-    ]
+    cat = cat or catalogo.actual()
+    return [list(fila) for fila in cat.teclado_sesiones] + [[VOLVER_MENU]]
 
-def generate_main_menu_keyboard():
+def generate_main_menu_keyboard(cat=None):
     """Generate main menu keyboard."""
-    return [
-        ['🚀 Coach Motivacional', '💙 Apoyo Emocional'],
-        ['📚 Ayuda para Docentes']
-    ]
+    return generate_service_keyboard(cat)
+
+def texto_tras_comando(texto, argumentos=0):
+    """
+    Return the raw text after a command and its first N arguments.
+    Unlike ' '.join(context.args) this keeps newlines and spacing intact.
+    """
+    coincidencia = re.match(r'\s*\S+' + r'\s+\S+' * argumentos + r'\s', texto or '')
+    if not coincidencia:
+        return ''
+    return texto[coincidencia.end():].strip()
 
 def save_temp_file(file_data, extension='.jpg'):
     """Save temporary file and return the path."""
@@ -106,9 +149,9 @@ def cleanup_temp_file(file_path):
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
-            logger.info(f"Temporary file {file_path} removed.")
+            logger.info("Temporary file %s removed.", file_path)
     except Exception as e:
-        logger.error(f"Error removing temporary file {file_path}: {e}")
+        logger.error("Error removing temporary file %s: %s", file_path, e)
 
 def is_returning_user(chat_id, current_time):
     """
@@ -174,9 +217,9 @@ async def handle_returning_user(update, context):
     chat_id = update.message.chat.id
     current_time = datetime.datetime.now()
     
-    # Skip for admin
-    from config import YOUR_TELEGRAM_ID
-    if chat_id == YOUR_TELEGRAM_ID:
+    # Skip for operators
+    from operators import pool
+    if pool.es_operador(chat_id):
         return False
     
     # Check if this is a returning user first
@@ -210,6 +253,6 @@ async def handle_returning_user(update, context):
         mensaje = f"¡Hola de nuevo, {nombre_usuario}! ¿En qué puedo ayudarte hoy?"
     
     await update.message.reply_text(mensaje, reply_markup=reply_markup)
-    logger.info(f"Returning user {chat_id} welcomed back with appropriate menu")
+    logger.info("Returning user %s welcomed back with appropriate menu", chat_id)
     
     return True
@@ -0,0 +1,183 @@
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+import urllib.request
+
+from config import (
+    WATCHDOG_INTERVALO_SEGUNDOS, WATCHDOG_LAG_SEGUNDOS, WATCHDOG_BLOQUEO_SEGUNDOS, WATCHDOG_HANDLER_SEGUNDOS
+)
+from logs import evento
+import tenants
+
+logger = logging.getLogger(__name__)
+
+URL_SEND_MESSAGE = "https://api.telegram.org/bot{token}/sendMessage"
+MAX_LINEAS_PILA = 25
+
+def _pila_hilo(hilo_id):
+    """Current stack of a thread, innermost frames last."""
+    frame = sys._current_frames().get(hilo_id)
+    if frame is None:
+        return "(sin pila)"
+    return ''.join(traceback.format_stack(frame, limit=MAX_LINEAS_PILA))
+
+def _pila_tarea(tarea):
+    """Await chain of a suspended task, from the handler down to what it is waiting on."""
+    lineas = []
+    corrutina = tarea.get_coro()
+    while corrutina is not None and len(lineas) < MAX_LINEAS_PILA:
+        frame = getattr(corrutina, 'cr_frame', None) or getattr(corrutina, 'gi_frame', None)
+        if frame is None:
+            break
+        lineas.append(f'  File "{frame.f_code.co_filename}", line {frame.f_lineno}, in {frame.f_code.co_name}')
+        corrutina = getattr(corrutina, 'cr_await', None) or getattr(corrutina, 'gi_yieldfrom', None)
+    return '\n'.join(lineas) or "(sin pila)"
+
+class VigiaLoop:
+    """
+    Event loop health monitor.
+
+    A heartbeat coroutine sleeps for a fixed interval and records how late it woke up
+    (scheduling lag). A separate thread checks that heartbeat: if it stops, the loop is
+    blocked, so it captures the loop thread's stack with sys._current_frames() and alerts
+    the admins straight through the Bot API, since the bots themselves run on that loop.
+    The same thread reports updates whose handlers have been running for too long.
+    """
+
+    def __init__(self, intervalo=WATCHDOG_INTERVALO_SEGUNDOS, umbral_lag=WATCHDOG_LAG_SEGUNDOS,
+                 umbral_bloqueo=WATCHDOG_BLOQUEO_SEGUNDOS, umbral_handler=WATCHDOG_HANDLER_SEGUNDOS):
+        self.intervalo = intervalo
+        self.umbral_lag = umbral_lag
+        self.umbral_bloqueo = umbral_bloqueo
+        self.umbral_handler = umbral_handler
+        self.lag = 0.0
+        self.lag_max = 0.0
+        self.bloqueos = 0
+        self.handlers_lentos = 0
+        self._ultimo_latido = None
+        self._hilo_loop = None
+        self._bloqueado = False
+        self._en_curso = {}  # id -> (start, description, tenant, task)
+        self._alertados = set()
+        self._secuencia = itertools.count(1)
+        self._hilo = None
+
+    def iniciar(self, loop):
+        """Start the heartbeat on loop and the monitoring thread. Safe to call from any thread."""
+        if self._hilo is not None:
+            return
+        asyncio.run_coroutine_threadsafe(self._latir(), loop)
+        self._hilo = threading.Thread(target=self._vigilar, name="vigia-loop", daemon=True)
+        self._hilo.start()
+
+    async def _latir(self):
+        self._hilo_loop = threading.get_ident()
+        self._ultimo_latido = time.monotonic()
+        while True:
+            inicio = time.monotonic()
+            await asyncio.sleep(self.intervalo)
+            ahora = time.monotonic()
+            self.lag = max(0.0, ahora - inicio - self.intervalo)
+            self.lag_max = max(self.lag_max, self.lag)
+            self._ultimo_latido = ahora
+            if self.lag >= self.umbral_lag:
+                evento(logger, 'loop_lento', nivel=logging.WARNING, lag_ms=round(self.lag * 1000))
+
+    def sano(self):
+        """True while the loop keeps running its heartbeat."""
+        return self._ultimo_latido is not None and time.monotonic() - self._ultimo_latido < self.umbral_bloqueo
+
+    def estado(self):
+        """Snapshot for /ready and /admin."""
+        silencio = time.monotonic() - self._ultimo_latido if self._ultimo_latido is not None else None
+        # Updates are refused (500) while a tenant cannot journal them
+        bitacora_sana = all(tenant.bitacora.sana() for tenant in tenants.todos())
+        return {
+            'sano': self.sano() and bitacora_sana,
+            'bitacora_sana': bitacora_sana,
+            'lag_ms': round(self.lag * 1000, 1),
+            'lag_max_ms': round(self.lag_max * 1000, 1),
+            'sin_latido_s': round(silencio, 1) if silencio is not None else None,
+            'handlers_en_curso': len(self._en_curso),
+            'bloqueos': self.bloqueos,
+            'handlers_lentos': self.handlers_lentos
+        }
+
+    def comenzar(self, descripcion):
+        """Track the current task as a running handler. Returns the id to pass to terminar()."""
+        marca = next(self._secuencia)
+        self._en_curso[marca] = (time.monotonic(), descripcion, tenants.tenant_actual.get(None), asyncio.current_task())
+        return marca
+
+    def terminar(self, marca):
+        """Stop tracking a handler."""
+        self._en_curso.pop(marca, None)
+        self._alertados.discard(marca)
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self._revisar_loop()
+                self._revisar_handlers()
+            except Exception as e:
+                logger.error("Watchdog check failed: %s", e)
+
+    def _revisar_loop(self):
+        if self._ultimo_latido is None:
+            return
+        silencio = time.monotonic() - self._ultimo_latido
+        if silencio < self.umbral_bloqueo:
+            if self._bloqueado:
+                self._bloqueado = False
+                evento(logger, 'loop_recuperado', nivel=logging.WARNING, bloqueado_s=round(self.lag, 1))
+            return
+        if self._bloqueado:
+            return
+        self._bloqueado = True
+        self.bloqueos += 1
+        pila = _pila_hilo(self._hilo_loop)
+        evento(logger, 'loop_bloqueado', nivel=logging.ERROR, sin_latido_s=round(silencio, 1))
+        logger.error("Event loop stack while blocked:\n%s", pila)
+        self._alertar(
+            tenants.todos(),
+            f"🚨 Event loop bloqueado: {silencio:.0f} s sin procesar updates.\n\nPila del loop:\n{pila}"
+        )
+
+    def _revisar_handlers(self):
+        ahora = time.monotonic()
+        for marca, (inicio, descripcion, tenant, tarea) in list(self._en_curso.items()):
+            duracion = ahora - inicio
+            if duracion < self.umbral_handler or marca in self._alertados:
+                continue
+            self._alertados.add(marca)
+            self.handlers_lentos += 1
+            pila = _pila_tarea(tarea) if tarea is not None else "(sin pila)"
+            evento(logger, 'handler_lento', nivel=logging.WARNING, update=descripcion, segundos=round(duracion))
+            logger.warning("Stack of slow handler %s:\n%s", descripcion, pila)
+            self._alertar(
+                [tenant] if tenant is not None else tenants.todos(),
+                f"⚠️ Handler lento: {descripcion} lleva {duracion:.0f} s.\n\nEsperando en:\n{pila}"
+            )
+
+    def _alertar(self, destinos, texto):
+        """Message the admins of each tenant through the Bot API directly, without the event loop."""
+        texto = texto if len(texto) <= 4000 else texto[:1500] + "\n...\n" + texto[-2400:]
+        for tenant in destinos:
+            for admin_id in tenant.pool.admins():
+                cuerpo = json.dumps({'chat_id': admin_id, 'text': texto}).encode()
+                peticion = urllib.request.Request(
+                    URL_SEND_MESSAGE.format(token=tenant.token), data=cuerpo,
+                    headers={'Content-Type': 'application/json'}
+                )
+                try:
+                    urllib.request.urlopen(peticion, timeout=10).close()
+                except Exception as e:
+                    logger.error("Could not send watchdog alert to %s: %s", admin_id, e)
+
+vigia = VigiaLoop()  # Single watchdog for the shared event loop